@@ -4,8 +4,7 @@ import logging
 from logging.handlers import RotatingFileHandler
 import time
 import os
-from datetime import datetime, timezone
-from pymongo import MongoClient
+from datetime import datetime
 import importlib
 
 # First define the logger setup
@@ -37,81 +36,12 @@ def setup_logger():
     
     return logger
 
-# Setup MongoDB function
-def setup_mongodb(app):
-    """Initialize MongoDB connection and setup collections"""
-    retry_count = 0
-    max_retries = 3
-    
-    while retry_count < max_retries:
-        try:
-            if "MONGODB_URI" not in app.config:
-                raise ValueError("MONGODB_URI not found in configuration")
-                
-            client = MongoClient(app.config["MONGODB_URI"])
-            # Test the connection
-            client.admin.command('ping')
-            
-            # Explicitly specify database name
-            db = client['sushanto']
-            
-            # Create collections if they don't exist
-            if 'users' not in db.list_collection_names():
-                db.create_collection('users')
-            if 'documents' not in db.list_collection_names():
-                db.create_collection('documents')
-            
-            # Create indexes
-            db.users.create_index('username', unique=True)
-            db.users.create_index([('role', 1), ('status', 1)])
-            db.documents.create_index('user_id')
-            db.documents.create_index('createdAt')
-            db.documents.create_index([("user_id", 1)])
-            db.documents.create_index([("bulk_id", 1)])
-            db.documents.create_index([("created_at", -1)])
-            
-            # Update existing users with new fields
-            db.users.update_many(
-                {'status': {'$exists': False}},
-                {'$set': {'status': 'active'}}
-            )
-            db.users.update_many(
-                {'created_at': {'$exists': False}},
-                {'$set': {'created_at': datetime.now(timezone.utc).isoformat()}}
-            )
-            
-            # Add validation rules
-            db.command({
-                'collMod': 'users',
-                'validator': {
-                    '$jsonSchema': {
-                        'bsonType': 'object',
-                        'required': ['username', 'password', 'role', 'status'],
-                        'properties': {
-                            'username': {'bsonType': 'string'},
-                            'password': {'bsonType': 'string'},
-                            'role': {'enum': ['user', 'admin']},
-                            'status': {'enum': ['active', 'restricted']},
-                            'created_at': {'bsonType': 'string'}
-                        }
-                    }
-                }
-            })
-            
-            app.logger.info("MongoDB setup completed successfully!")
-            return db
-            
-        except Exception as e:
-            retry_count += 1
-            app.logger.error(f"MongoDB connection attempt {retry_count} failed: {str(e)}")
-            if retry_count >= max_retries:
-                app.logger.critical("Failed to connect to MongoDB after maximum retries")
-                raise
-            time.sleep(2 ** retry_count)  # Exponential backoff
-
 # Create and configure the app
 app = Flask(__name__)
 
+from utils.db import get_client, get_database, pool_stats
+from utils.migrations import SCHEMA_VERSION, check_schema_version, migrate
+
 # Import config after app is created
 from config import Config
 app.config.from_object(Config)
@@ -202,14 +132,35 @@ def options_handler(path):
     
     return response
 
-# Initialize MongoDB
+# Check the MongoDB schema version; migrations run separately (flask --app app migrate)
 with app.app_context():
     try:
-        db = setup_mongodb(app)
-        app.db = db  # Store database connection in app context
+        check_schema_version(get_database(), app.logger)
     except Exception as e:
-        app.logger.error(f"Failed to initialize MongoDB: {str(e)}")
-        # Continue running the application even if DB setup fails
+        app.logger.error(f"Failed to check MongoDB schema version: {str(e)}")
+        # Continue running the application even if the database is unreachable
+
+def run_migrations():
+    """
+    Apply pending MongoDB schema migrations.
+
+    Entry point for deploy targets without the flask CLI (see utils/migrations.py).
+
+    Returns:
+        list: Versions applied by this run
+    """
+    with app.app_context():
+        applied = migrate(get_database(), app.logger)
+    if applied:
+        app.logger.info(f"Applied schema migrations: {applied}")
+    else:
+        app.logger.info(f"MongoDB schema already at version {SCHEMA_VERSION}")
+    return applied
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending MongoDB schema migrations."""
+    run_migrations()
 
 
 # Import and register blueprints
@@ -221,9 +172,8 @@ app.register_blueprint(word.bp)
 @app.route('/health')
 def health_check():
     try:
-        # Use the client object to access the admin database
-        client = MongoClient(app.config["MONGODB_URI"])
-        client.admin.command('ping')
+        # Ping through the shared client, reusing a pooled connection
+        get_client().admin.command('ping')
         return jsonify({"status": "healthy"}), 200
     except Exception as e:
         app.logger.error(f"Health check failed: {str(e)}")
@@ -275,6 +225,35 @@ def get_logs():
         app.logger.error(f"Error accessing logs: {str(e)}")
         return jsonify({"message": f"Error: {str(e)}"}), 500
     
+@app.route('/admin/db-pool', methods=['GET'])
+def get_db_pool_stats():
+    """Connection pool statistics of the MongoDB client of the worker serving the request."""
+    from utils.auth import get_user_from_token
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({"message": "Token is required"}), 401
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({"message": "Invalid token"}), 401
+    if user['role'] != 'admin':
+        return jsonify({"message": "Unauthorized"}), 403
+    return jsonify(pool_stats()), 200
+
+@app.route('/admin/password-pool', methods=['GET'])
+def get_password_pool_stats():
+    """Queue depth and counters of the password executor of the worker serving the request."""
+    from utils.auth import get_user_from_token
+    from utils.passwords import password_hasher
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({"message": "Token is required"}), 401
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({"message": "Invalid token"}), 401
+    if user['role'] != 'admin':
+        return jsonify({"message": "Unauthorized"}), 403
+    return jsonify(password_hasher.stats()), 200
+
 # Add this to your app.py file, just before the if __name__ == '__main__': block
 
 @app.route('/cors-test', methods=['GET', 'OPTIONS'])
@@ -0,0 +1,120 @@
+"""
+Benchmark of the document passes on a synthetic template.
+
+Builds a template with placeholder paragraphs, segment sections and tables of
+placeholder rows, then times:
+
+    parse       Document(path), what every request paid before templates were cached
+    clone       CompiledTemplate.clone(), what a request pays now
+    proxies     reading every table paragraph through python-docx proxies
+                (doc.tables -> rows -> cells -> paragraphs)
+    index       resolving the placeholder index against a copy and reading
+                the table paragraphs it points at
+    render      load_document + populate_document + save with a warm skeleton cache
+
+Usage, from the repository root:
+
+    python benchmarks/document_passes.py [--tables 25] [--rows 10] [--cols 8] [--runs 10]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docx import Document
+from flask import Flask
+
+from routes.word import load_document, populate_document
+from utils.docx_xml import paragraph_text
+from utils.templates import load_template, template_cache
+
+def build_template(path, tables, rows, cols):
+    """Write a template with tables spread over six segment sections."""
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = '{{market_name}} Market Report'
+    doc.add_heading('{{market_name}} Market', 0)
+    doc.add_paragraph('Scope: {{region}}')
+    for table_index in range(tables):
+        segment = table_index % 6 + 1
+        doc.add_paragraph(f'{{{{Segment{segment}_Start}}}}')
+        doc.add_heading(f'{{{{market_name}}}} by {{{{Segment{segment}}}}}', 1)
+        table = doc.add_table(rows=1, cols=cols)
+        table.rows[0].cells[0].text = f'{{{{Segment{segment}}}}}'
+        for row_index in range(1, rows + 1):
+            cells = table.add_row().cells
+            cells[0].text = f'{{{{Segment{segment}Sub-segment{row_index % 10 + 1}}}}}'
+            for col in range(1, cols):
+                cells[col].text = f'{row_index}.{col}'
+        doc.add_paragraph(f'{{{{Segment{segment}_End}}}}')
+    for company in range(1, 11):
+        doc.add_paragraph(f'{{{{Company{company}}}}}')
+    doc.save(path)
+
+PAYLOAD = {
+    'template_type': 'Global',
+    'market_name': 'Widget',
+    'Segment1': 'Type', 'Segment1Sub-segment1': 'A', 'Segment1Sub-segment2': 'B',
+    'Segment2': 'Application', 'Segment2Sub-segment1': 'X',
+    'Segment3': 'End Use', 'Segment3Sub-segment1': 'E1',
+    'Company1': 'Acme', 'Company2': 'Globex'
+}
+
+def read_with_proxies(doc):
+    return [
+        paragraph.text
+        for table in doc.tables
+        for row in table.rows
+        for cell in row.cells
+        for paragraph in cell.paragraphs
+    ]
+
+def read_with_index(template):
+    return [
+        paragraph_text(bound.element)
+        for bound in template.placeholders.bind(template.clone())
+        if bound.row is not None
+    ]
+
+def render(path):
+    instance = load_document(path, PAYLOAD)
+    populate_document(instance, PAYLOAD)
+    out = BytesIO()
+    instance.doc.save(out)
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tables', type=int, default=25)
+    parser.add_argument('--rows', type=int, default=10)
+    parser.add_argument('--cols', type=int, default=8)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.logger.disabled = True
+    with tempfile.TemporaryDirectory() as directory, app.app_context():
+        path = os.path.join(directory, 'benchmark_template.docx')
+        build_template(path, args.tables, args.rows, args.cols)
+        template_cache.clear()
+        template = load_template(path).template
+        parsed = Document(path)
+        render(path)  # build the skeleton
+
+        cases = [
+            ('parse', lambda: Document(path)),
+            ('clone', template.clone),
+            ('proxies', lambda: read_with_proxies(parsed)),
+            ('index', lambda: read_with_index(template)),
+            ('render', lambda: render(path)),
+        ]
+        print(f"{args.tables} tables x {args.rows + 1} rows x {args.cols} columns, best of 5 x {args.runs} runs")
+        for name, fn in cases:
+            best = min(timeit.repeat(fn, number=args.runs, repeat=5)) / args.runs
+            print(f"  {name:<8} {best * 1000:8.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -16,4 +16,67 @@ class Config:
     CORS_ORIGINS = [
         'https://sample-generator.vercel.app',
         'http://localhost:3000'
-    ]
\ No newline at end of file
+    ]
+
+    # Pruned template skeletons kept per worker, one per (template, segment shape)
+    SKELETON_CACHE_SIZE = int(os.environ.get('SKELETON_CACHE_SIZE', 64))
+
+    # Generated document cache: per-worker memory tier and a disk tier shared by all workers
+    OUTPUT_CACHE_MEMORY_BYTES = int(os.environ.get('OUTPUT_CACHE_MEMORY_BYTES', 64 * 1024 * 1024))
+    OUTPUT_CACHE_DISK_BYTES = int(os.environ.get('OUTPUT_CACHE_DISK_BYTES', 1024 * 1024 * 1024))
+    OUTPUT_CACHE_DIR = os.environ.get('OUTPUT_CACHE_DIR')
+
+    # Background threads per worker process running asynchronous /word/generate jobs
+    GENERATION_WORKERS = int(os.environ.get('GENERATION_WORKERS', 2))
+    # Asynchronous jobs not finished this long after being queued or started are reported failed
+    GENERATION_JOB_TIMEOUT_SECONDS = int(os.environ.get('GENERATION_JOB_TIMEOUT_SECONDS', 600))
+
+    # Serverless platforms (zappa on Lambda, Vercel) freeze threads between requests
+    SERVERLESS = bool(os.environ.get('AWS_LAMBDA_FUNCTION_NAME') or os.environ.get('VERCEL'))
+
+    # Processes per web worker generating bulk documents in parallel; 0
+    # generates in the web worker itself. Each process imports pandas, lxml
+    # and python-docx and keeps its own template and skeleton caches, so
+    # expect well over 100 MB resident per process while a pool is up. The
+    # pool is kept between jobs and shut down after BULK_POOL_IDLE_SECONDS
+    # without one (0 keeps it for the life of the web worker).
+    BULK_WORKERS = int(os.environ.get('BULK_WORKERS', 2))
+    BULK_POOL_IDLE_SECONDS = int(os.environ.get('BULK_POOL_IDLE_SECONDS', 300))
+
+    # Bulk rows whose MongoDB writes are buffered and flushed together
+    BULK_WRITE_BATCH_SIZE = int(os.environ.get('BULK_WRITE_BATCH_SIZE', 50))
+
+    # Bulk CSV ingestion: bytes sampled to detect the encoding, rows parsed per chunk
+    BULK_CSV_SAMPLE_BYTES = int(os.environ.get('BULK_CSV_SAMPLE_BYTES', 64 * 1024))
+    BULK_CSV_CHUNK_ROWS = int(os.environ.get('BULK_CSV_CHUNK_ROWS', 500))
+
+    # Bulk ZIP archives are kept in memory up to this size, then spooled to disk
+    BULK_ZIP_SPOOL_BYTES = int(os.environ.get('BULK_ZIP_SPOOL_BYTES', 8 * 1024 * 1024))
+
+    # Copies of streamed bulk uploads are kept in memory up to this size, then spooled to disk
+    BULK_UPLOAD_SPOOL_BYTES = int(os.environ.get('BULK_UPLOAD_SPOOL_BYTES', 8 * 1024 * 1024))
+
+    # Shared MongoDB client: one per worker process, created lazily after fork
+    MONGODB_DB_NAME = os.environ.get('MONGODB_DB_NAME', 'sushanto')
+    MONGODB_MAX_POOL_SIZE = int(os.environ.get('MONGODB_MAX_POOL_SIZE', 20))
+    MONGODB_MIN_POOL_SIZE = int(os.environ.get('MONGODB_MIN_POOL_SIZE', 0))
+    MONGODB_MAX_IDLE_TIME_MS = int(os.environ.get('MONGODB_MAX_IDLE_TIME_MS', 60000))
+    MONGODB_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGODB_CONNECT_TIMEOUT_MS', 10000))
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 10000))
+    MONGODB_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGODB_SOCKET_TIMEOUT_MS', 60000))
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 10000))
+
+    # Users authorized from tokens, cached per worker; 0 disables the cache
+    USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS', 30))
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+
+    # Authorize from token claims without a database lookup; restricted users
+    # are rejected through a revocation set reloaded from MongoDB on this interval
+    AUTH_STATELESS_TOKENS = os.environ.get('AUTH_STATELESS_TOKENS', '').lower() in ('1', 'true', 'yes')
+    REVOCATION_SYNC_SECONDS = int(os.environ.get('REVOCATION_SYNC_SECONDS', 15))
+
+    # bcrypt work factor of new hashes; logins rehash stored hashes of another cost
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+    # Threads per worker hashing and checking passwords, and calls allowed to wait for them
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', 32))
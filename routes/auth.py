@@ -1,16 +1,22 @@
 from flask import Blueprint, request, jsonify, current_app
 import secrets
 import datetime
-from pymongo import MongoClient
 from bson.objectid import ObjectId
-from bcrypt import hashpw, gensalt
 from models.user import User
-from utils.auth import authenticate_user, create_token, get_user_from_token
+from utils.auth import authenticate_user, create_token, get_user_from_token, revoked_users, user_cache
+from utils.db import get_database
+from utils.passwords import PasswordQueueFull, hash_password, needs_rehash, rehash_in_background
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
 def get_db():
-    return current_app.db
+    return get_database()
+
+def password_queue_full():
+    """503 response for a request refused because the password executor is saturated."""
+    response = jsonify({'message': 'Server is busy, please try again shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 # Add new GET users endpoint
 @bp.route('/users', methods=['GET'])
@@ -61,10 +67,14 @@ def register():
         current_app.logger.warning(f'Register attempt failed. Username already exists')
         return jsonify({'message': 'Username already exists'}), 409
 
-    hashed_password = hashpw(password.encode('utf-8'), gensalt())
+    try:
+        hashed_password = hash_password(password)
+    except PasswordQueueFull:
+        current_app.logger.warning('Register attempt refused. Password executor is busy')
+        return password_queue_full()
     user = User(
         username=username,
-        password=hashed_password.decode('utf-8'),
+        password=hashed_password,
         role=role,
         status=status
     )
@@ -102,6 +112,8 @@ def update_user_status(user_id):
         {'_id': ObjectId(user_id)},
         {'$set': {'status': new_status}}
     )
+    user_cache.invalidate(user_id)
+    revoked_users.update(user_id, new_status)
 
     if result.modified_count > 0:
         current_app.logger.info(f"User status updated by admin {admin_user['username']}")
@@ -142,7 +154,17 @@ def login():
             current_app.logger.warning(f'Login attempt failed. User account is restricted: {username}')
             return jsonify({'message': 'Account is restricted'}), 403
 
-        token = create_token({'user_id': str(user['_id']), 'role': user['role']})
+        if needs_rehash(user['password']):
+            rehash_in_background(
+                current_app._get_current_object(), users_collection, user['_id'], password, user['password']
+            )
+
+        token = create_token({
+            'user_id': str(user['_id']),
+            'username': user['username'],
+            'role': user['role'],
+            'status': user.get('status', 'active')
+        })
         current_app.logger.info(f'Login successful for user: {username}')
         return jsonify({
             'message': 'Login successful',
@@ -150,6 +172,9 @@ def login():
             'role': user['role'],
             'username': user['username']
         }), 200
+    except PasswordQueueFull:
+        current_app.logger.warning('Login attempt refused. Password executor is busy')
+        return password_queue_full()
     except Exception as e:
         current_app.logger.error(f'Unexpected error during login: {str(e)}')
         return jsonify({'message': 'An error occurred during login', 'error': str(e)}), 500
@@ -234,11 +259,16 @@ def reset_password():
         return jsonify({'message': 'Unauthorized'}), 403
     
     # Update the password
-    hashed_password = hashpw(new_password.encode('utf-8'), gensalt())
+    try:
+        hashed_password = hash_password(new_password)
+    except PasswordQueueFull:
+        current_app.logger.warning('Reset password attempt refused. Password executor is busy')
+        return password_queue_full()
     users_collection.update_one(
         {'_id': user['_id']},
-        {'$set': {'password': hashed_password.decode('utf-8')}}
+        {'$set': {'password': hashed_password}}
     )
+    user_cache.invalidate(user['_id'])
     
     # Delete the used token
     reset_tokens_collection.delete_one({'_id': token_doc['_id']})
@@ -1,24 +1,43 @@
-from flask import Blueprint, request, jsonify, send_file, current_app, make_response
-from docx import Document
-from io import BytesIO, StringIO
-from utils.auth import get_user_from_token
-from pymongo import MongoClient
+from flask import Flask, Blueprint, Response, request, jsonify, send_file, current_app, make_response, stream_with_context
+from io import BytesIO
+from utils.auth import get_user_from_token, revoked_users, user_cache
+from utils.db import get_client, get_database
+from utils.templates import load_template, skeleton_cache, template_cache
+from utils.output_cache import output_cache, output_key
+from utils import jobs
+from utils.process_local import ProcessLocal
+from utils.docx_xml import (
+    A_NS, A_T, V_NS, W_DIRTY, W_NS, W_T, XML_SPACE,
+    iter_header_parts, paragraph_text, paragraph_text_nodes
+)
+from pymongo import InsertOne, UpdateOne
 import traceback
 from docx.oxml import parse_xml
 from docx.oxml.ns import nsdecls
 from docx.oxml import OxmlElement
 from lxml import etree
 import csv
+import numpy as np
 import pandas as pd
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import pytz
 from bson.objectid import ObjectId
 import os
 import re
-import zipfile
-from lxml import etree
 import shutil
 import tempfile
+import zipfile
+from lxml import etree
+from bisect import bisect_right
+from functools import lru_cache, partial
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import codecs
+import itertools
+import logging
+import multiprocessing
+import threading
 
 # Blueprint for Word document generation routes
 bp = Blueprint('word', __name__, url_prefix='/word')
@@ -28,9 +47,7 @@ def get_db():
     Central function to get database connection consistently
     throughout the application
     """
-    client = MongoClient(current_app.config["MONGODB_URI"])
-    db = client['sushanto']  # Use consistent database name
-    return db, client
+    return get_database(), get_client()
 
 def get_template_path(template_type, region=None):
     """
@@ -108,208 +125,233 @@ def validate_region(region):
     
     return region
 
-def replace_region(doc, region):
-    """Replace region placeholder in the document."""
-    current_app.logger.info(f"Replacing region placeholder with: {region}")
-    replace_text(doc, "{{region}}", region)
+def build_replacements(data):
+    """
+    Collect every placeholder value for a request into one mapping.
+    
+    Args:
+        data (dict): Request payload (single generation JSON or a bulk CSV row)
+        
+    Returns:
+        dict: Mapping of '{{placeholder}}' to its replacement text
+    """
+    replacements = {}
+    template_type = data.get("template_type", "Global")
+
+    if template_type == "Regional" and data.get("region"):
+        replacements["{{region}}"] = data["region"]
+    elif template_type == "Country" and data.get("country"):
+        replacements["{{country}}"] = data["country"]
+
+    if data.get("market_name"):
+        replacements["{{market_name}}"] = data["market_name"]
+
+    for i in range(1, 7):
+        if f"Segment{i}" not in data:
+            continue
+        replacements[f"{{{{Segment{i}}}}}"] = data[f"Segment{i}"]
+        for j in range(1, 11):
+            sub_key = f"Segment{i}Sub-segment{j}"
+            if sub_key in data:
+                replacements[f"{{{{{sub_key}}}}}"] = data[sub_key]
+
+    # Unfilled company slots are blanked rather than left as placeholders
+    for i in range(1, 11):
+        replacements[f"{{{{Company{i}}}}}"] = data.get(f"Company{i}", "")
 
-def replace_country(doc, country):
-    """Replace country placeholder in the document."""
-    current_app.logger.info(f"Replacing country placeholder with: {country}")
-    replace_text(doc, "{{country}}", country)
+    return {key: "" if value is None else str(value) for key, value in replacements.items()}
 
-def replace_textbox_text(doc, placeholder, replacement):
+def build_segmentations(data):
     """
-    Replace placeholders in textboxes throughout the Word document including headers.
+    Convert the flat SegmentN / SegmentNSub-segmentM keys into the structured
+    list used by the pruning passes. Entry N-1 always describes SegmentN, so a
+    gap in the input leaves an empty entry rather than shifting later segments.
     """
-    current_app.logger.info(f"Starting replacement process for '{placeholder}'")
-    replacement_done = False
-    
-    namespaces = {
-        'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
-        'mc': 'http://schemas.openxmlformats.org/markup-compatibility/2006',
-        'wps': 'http://schemas.microsoft.com/office/word/2010/wordprocessingShape'
-    }
-
-    def process_element(element):
-        nonlocal replacement_done
-        textbox_paths = [
-            './/w:txbxContent',
-            './/mc:AlternateContent//w:txbxContent',
-            './/wps:txbx//w:txbxContent'
+    segmentations = []
+    for i in range(1, 7):
+        if f"Segment{i}" not in data:
+            segmentations.append({"name": "", "subSegments": []})
+            continue
+        sub_segments = [
+            data[f"Segment{i}Sub-segment{j}"]
+            for j in range(1, 11)
+            if f"Segment{i}Sub-segment{j}" in data
         ]
-        
-        for path in textbox_paths:
-            for txbox in element.findall(path, namespaces):
-                current_app.logger.debug(f"Found textbox with path: {path}")
-                for t in txbox.findall('.//w:t', namespaces):
-                    if t.text and placeholder in t.text:
-                        current_app.logger.info(f"Found placeholder in text: {t.text}")
-                        t.text = t.text.replace(placeholder, replacement)
-                        replacement_done = True
-                        current_app.logger.info(f"Replaced with: {t.text}")
-
-    # Process headers in all sections
-    for section in doc.sections:
-        if section.header:
-            try:
-                # Process header part
-                header_element = section.header._element
-                process_element(header_element)
-                
-                # Also process any header references
-                if hasattr(section.header, 'part'):
-                    process_element(section.header.part.element)
-            except Exception as e:
-                current_app.logger.error(f"Error processing header: {str(e)}", exc_info=True)
+        segmentations.append({"name": data[f"Segment{i}"], "subSegments": sub_segments})
 
-    # Process main document
-    for part in doc.part.package.parts:
-        try:
-            if hasattr(part, 'element'):
-                process_element(part.element)
-        except Exception as e:
-            current_app.logger.error(f"Error processing part {part.partname}: {str(e)}", exc_info=True)
-    
-    if not replacement_done:
-        current_app.logger.warning("No replacements were made")
-    
-    return replacement_done
-
-def replace_text(doc, placeholder, replacement):
-    """Replace placeholders throughout the document and log replacements."""
-    replacement_done = False
-
-    for paragraph in doc.paragraphs:
-        if placeholder in paragraph.text:
-            current_app.logger.debug(f"Replacing '{placeholder}' with '{replacement}' in paragraph: {paragraph.text}")
-            paragraph.text = paragraph.text.replace(placeholder, replacement)
-            replacement_done = True
-
-    for section in doc.sections:
-        header = section.header
-        if header:
-            for paragraph in header.paragraphs:
-                if placeholder in paragraph.text:
-                    current_app.logger.debug(f"Replacing '{placeholder}' with '{replacement}' in header paragraph: {paragraph.text}")
-                    paragraph.text = paragraph.text.replace(placeholder, replacement)
-                    replacement_done = True
-
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    if placeholder in paragraph.text:
-                        current_app.logger.debug(f"Replacing '{placeholder}' with '{replacement}' in table cell: {paragraph.text}")
-                        paragraph.text = paragraph.text.replace(placeholder, replacement)
-                        replacement_done = True
-
-    if not replacement_done:
-        current_app.logger.warning(f"No occurrences of '{placeholder}' found in the document for replacement.")
-
-def replace_segments(doc, segments):
-    """Replace placeholders for segments and sub-segments in the document."""
-    for i, segment in enumerate(segments):
-        segment_key = f"{{{{Segment{i + 1}}}}}"
-        segment_name = segment.get("name", "")
-        current_app.logger.info(f"Replacing segment placeholder: {segment_key} with '{segment_name}'")
-        replace_text(doc, segment_key, segment_name)
-
-        sub_segments = segment.get("subSegments", [])
-        for j, subsegment in enumerate(sub_segments):
-            sub_key = f"{{{{Segment{i + 1}Sub-segment{j + 1}}}}}"
-            current_app.logger.info(f"Replacing sub-segment placeholder: {sub_key} with '{subsegment}'")
-            replace_text(doc, sub_key, subsegment)
-
-def replace_companies(doc, companies):
-    """Replace placeholders for company names in the document."""
-    for i, company in enumerate(companies[:10]):  # Limit to 10 companies
-        company_key = f"{{{{Company{i + 1}}}}}"
-        current_app.logger.info(f"Replacing company placeholder: {company_key} with '{company}'")
-        replace_text(doc, company_key, company)
-
-def clean_empty_segments(doc, user_inputs):
+    while segmentations and not segmentations[-1]["name"]:
+        segmentations.pop()
+    return segmentations
+
+@lru_cache(maxsize=256)
+def _compile_placeholder_pattern(placeholders):
+    # Longest first so that e.g. {{Segment1Sub-segment10}} wins over {{Segment1Sub-segment1}}
+    ordered = sorted(placeholders, key=len, reverse=True)
+    return re.compile('|'.join(re.escape(placeholder) for placeholder in ordered))
+
+def compile_replacements(replacements):
+    """Compile the placeholders of a replacement mapping into a single regex alternation."""
+    return _compile_placeholder_pattern(tuple(sorted(replacements)))
+
+def _splice_text_nodes(text_nodes, pattern, replacements):
     """
-    Removes paragraphs and table rows containing unprocessed placeholders 
-    for segments and sub-segments.
+    Apply every match of pattern across a paragraph's text nodes in place.
+    
+    Placeholders split over several runs are handled: the replacement goes into
+    the run where the placeholder starts and the remaining fragments are emptied,
+    so run formatting and any non-text content of the paragraph are preserved.
+    
+    Returns:
+        int: Number of placeholders replaced
     """
-    segment_placeholders = []
-
-    # Generate all possible placeholders for segments 1-6 and sub-segments 1-10
-    for i in range(1, 7):  # Segments 1-6
-        segment_placeholders.append(f"{{{{Segment{i}}}}}") 
-        # Also add variation with lowercase 's'
-        segment_placeholders.append(f"{{{{Segment{i}}}}}") 
-        for j in range(1, 11):  # Sub-Segments 1-10
-            # Add both variants of sub-segment formatting
-            segment_placeholders.append(f"{{{{Segment{i}Sub-Segment{j}}}}}")
-            segment_placeholders.append(f"{{{{Segment{i}Sub-segment{j}}}}}")
-
-    current_app.logger.info(f"Checking for these placeholders: {segment_placeholders}")
-
-    # Remove paragraphs containing unprocessed placeholders
-    paragraphs_to_remove = []  
-    for para in doc.paragraphs:
-        para_text = para.text.strip()
-        if not para_text:
-            continue
+    texts = [node.text or '' for node in text_nodes]
+    matches = list(pattern.finditer(''.join(texts)))
+    if not matches:
+        return 0
+
+    offsets = []
+    position = 0
+    for text in texts:
+        offsets.append(position)
+        position += len(text)
+
+    # Right to left, so earlier offsets stay valid while later nodes are edited
+    for match in reversed(matches):
+        start, end = match.span()
+        first = bisect_right(offsets, start) - 1
+        last = bisect_right(offsets, end - 1) - 1
+        head = texts[first][:start - offsets[first]]
+        tail = texts[last][end - offsets[last]:]
+        value = replacements[match.group(0)]
+        if first == last:
+            texts[first] = head + value + tail
+        else:
+            texts[first] = head + value
+            for k in range(first + 1, last):
+                texts[k] = ''
+            texts[last] = tail
+
+    for node, text in zip(text_nodes, texts):
+        if node.text != text:
+            node.text = text
+            if node.tag != A_T and text != text.strip():
+                node.set(XML_SPACE, 'preserve')
+    return len(matches)
+
+def replace_placeholders(doc, replacements, placeholders):
+    """
+    Replace all placeholders of a request in a single traversal of the document.
+    
+    Only the paragraphs the placeholder index (see utils.templates.PlaceholderIndex)
+    knows to contain one of the placeholders are visited - in the body, tables
+    at any nesting depth, textboxes, headers and footers, and DrawingML text -
+    and each is rewritten with one compiled matcher covering the whole mapping.
+    
+    Args:
+        doc: The Word document object
+        replacements (dict): Mapping of '{{placeholder}}' to replacement text
+        placeholders (list): Bound placeholder index for this document
         
-        current_app.logger.info(f"Processing paragraph: '{para_text}'")
-
-        # Check if any placeholder is still in the text
-        found_placeholders = [ph for ph in segment_placeholders if ph in para_text]
-        if found_placeholders:
-            current_app.logger.info(f"Found unprocessed placeholders in paragraph: {found_placeholders}")
-            current_app.logger.info(f"Marking paragraph for removal: '{para_text}'")
-            paragraphs_to_remove.append(para)
-
-    # Remove marked paragraphs
-    for para in paragraphs_to_remove:
-        p = para._element
-        p.getparent().remove(p)
-        current_app.logger.info(f"Removed paragraph: '{para.text.strip()}'")
-
-    # Remove table rows containing unprocessed placeholders
-    for table in doc.tables:
-        rows_to_remove = []  
-        for row in table.rows:
-            row_cells = [cell.text.strip() for cell in row.cells]
-            row_text = " | ".join(row_cells)
-            if not row_text.strip():
-                continue
-            
-            current_app.logger.info(f"Processing table row: '{row_text}'")
+    Returns:
+        int: Number of placeholder occurrences replaced
+    """
+    if not replacements:
+        return 0
 
-            # Check each cell individually
-            found_placeholders = []
-            for cell in row.cells:
-                cell_text = " ".join([p.text.strip() for p in cell.paragraphs if p.text.strip()])
-                for placeholder in segment_placeholders:
-                    if placeholder in cell_text:
-                        found_placeholders.append(placeholder)
-                        current_app.logger.info(f"Found placeholder in cell: {placeholder}")
+    pattern = compile_replacements(replacements)
+    keys = replacements.keys()
+    elements = (bound.element for bound in placeholders if not bound.tokens.isdisjoint(keys))
 
-            if found_placeholders:
-                current_app.logger.info(f"Found unprocessed placeholders in row: {found_placeholders}")
-                current_app.logger.info(f"Marking row for removal: '{row_text}'")
-                rows_to_remove.append(row)
+    replaced = 0
+    for element in elements:
+        text_nodes = paragraph_text_nodes(element)
+        if text_nodes:
+            replaced += _splice_text_nodes(text_nodes, pattern, replacements)
 
-        # Remove marked rows
-        for row in rows_to_remove:
-            tr = row._element
-            tr.getparent().remove(tr)
-            current_app.logger.info(f"Removed table row with placeholders")
+    current_app.logger.info(f"Replaced {replaced} placeholder occurrences for {len(replacements)} placeholders")
+    return replaced
 
-    current_app.logger.info("Finished cleaning empty segments and table rows.")
+# Segment and sub-segment placeholders left unfilled after substitution
+RESIDUAL_SEGMENT_PATTERN = re.compile(r'\{\{Segment[1-6](?:Sub-[Ss]egment(?:10|[1-9]))?\}\}')
 
-def remove_unused_sections(doc, user_inputs):
+def _has_unfilled_segment(text, filled):
+    return any(token not in filled for token in RESIDUAL_SEGMENT_PATTERN.findall(text))
+
+def clean_empty_segments(doc, placeholders, filled):
+    """
+    Removes paragraphs and table rows containing unprocessed placeholders 
+    for segments and sub-segments.
+    
+    Unfilled tokens are found with one compiled pattern over the indexed body
+    paragraphs and table rows. Affected paragraphs and rows are collected
+    first and removed in bulk.
+    
+    Args:
+        doc: The Word document object
+        placeholders (list): Bound placeholder index for this document
+        filled (set): Placeholders that will be substituted afterwards; the
+            document is cleaned before substitution, so only segment
+            placeholders outside this set count as unfilled.
+    
+    Returns:
+        dict: Number of removed paragraphs and table rows
+    """
+    document_part = str(doc.part.partname)
+    paragraphs_to_remove = []
+    rows_to_remove = {}
+
+    for bound in placeholders:
+        if bound.part_name != document_part or bound.in_textbox:
+            continue
+        if not (bound.body_level or bound.row is not None):
+            continue
+        if not _has_unfilled_segment(paragraph_text(bound.element), filled):
+            continue
+        if bound.body_level:
+            paragraphs_to_remove.append(bound.element)
+        else:
+            rows_to_remove[bound.row] = None
+
+    for element in paragraphs_to_remove + list(rows_to_remove):
+        parent = element.getparent()
+        if parent is not None:
+            parent.remove(element)
+
+    counts = {'paragraphs': len(paragraphs_to_remove), 'rows': len(rows_to_remove)}
+    current_app.logger.info(
+        f"Removed {counts['paragraphs']} paragraphs and {counts['rows']} table rows with unfilled segment placeholders"
+    )
+    return counts
+
+SEGMENT_MARKER_PATTERN = re.compile(r'\{\{Segment([1-6])_(Start|End)\}\}')
+
+def _segment_markers(tokens):
+    """Return (segment number, is_start) for every segment marker in tokens, starts first."""
+    found = []
+    for token in tokens:
+        match = SEGMENT_MARKER_PATTERN.fullmatch(token)
+        if match:
+            found.append((int(match.group(1)), match.group(2) == 'Start'))
+    found.sort(key=lambda marker: not marker[1])
+    return found
+
+def remove_unused_sections(doc, user_inputs, placeholders):
     """
     Removes entire sections of content between {{SegmentX_Start}} and {{SegmentX_End}} 
-    markers for segments that aren't present in user_inputs.
+    markers for segments that aren't present in user_inputs, and removes the
+    markers themselves for every segment.
+    
+    The body is scanned once: marker zones for all six segments are found
+    together, absent segments' zones and all marker paragraphs are removed in
+    a single sweep, and markers left inside tables or textboxes are stripped.
     
     Args:
         doc: The Word document object
         user_inputs: List of segment dictionaries containing user input data
+        placeholders (list): Bound placeholder index for this document
+        
+    Returns:
+        int: Number of body elements removed
     """
     # Get the list of segment numbers that are present in user inputs
     present_segments = set()
@@ -318,142 +360,111 @@ def remove_unused_sections(doc, user_inputs):
             present_segments.add(i + 1)
     
     current_app.logger.info(f"Present segments: {present_segments}")
-    
-    # Find and store all paragraph and table elements between markers
-    for segment_num in range(1, 7):  # For segments 1-6
-        if segment_num not in present_segments:
-            start_marker = f"{{{{Segment{segment_num}_Start}}}}"
-            end_marker = f"{{{{Segment{segment_num}_End}}}}"
-            
-            # Process each segment that needs to be removed
-            all_elements = list(doc.element.body)
-            
-            # Track markers - we may have multiple instances of the same segment
-            segment_zones = []
-            start_idx = None
-            
-            # First pass: Identify all zones to remove
-            for idx, element in enumerate(all_elements):
-                # Check if element is a paragraph
-                if element.tag.endswith('p'):
-                    paragraph_idx = len([e for e in all_elements[:idx] if e.tag.endswith('p')])
-                    if paragraph_idx < len(doc.paragraphs):
-                        paragraph = doc.paragraphs[paragraph_idx]
-                        
-                        if start_marker in paragraph.text and start_idx is None:
-                            start_idx = idx
-                        
-                        if end_marker in paragraph.text and start_idx is not None:
-                            segment_zones.append((start_idx, idx))
-                            start_idx = None  # Reset for potential next instance
-            
-            # Second pass: Remove the identified zones in reverse order
-            # (removing from end to start to avoid index shifting issues)
-            current_app.logger.info(f"Found {len(segment_zones)} instances of Segment {segment_num} to remove")
-            
-            for start_idx, end_idx in sorted(segment_zones, reverse=True):
-                elements_to_remove = all_elements[start_idx:end_idx+1]
-                
-                current_app.logger.info(f"Removing section for Segment {segment_num} (indices {start_idx}-{end_idx})")
-                
-                for element_to_remove in elements_to_remove:
-                    if element_to_remove.getparent() is not None:
-                        element_to_remove.getparent().remove(element_to_remove)
 
-def clean_all_segment_markers(doc):
-    """
-    Removes all segment markers (start and end) from the document,
-    including those for present segments.
-    """
+    body = doc.element.body
+    children = list(body)
+
+    # Marker paragraphs are already known from the template index
+    marker_paragraphs = {}
+    for bound in placeholders:
+        if bound.body_level:
+            markers = _segment_markers(bound.tokens)
+            if markers:
+                marker_paragraphs[bound.element] = markers
+    markers_of = marker_paragraphs.get
+
+    # Single scan: record marker paragraphs and the zones of absent segments.
+    # A segment may have several zones; each runs from a start marker to the next end marker.
+    is_marker = [False] * len(children)
+    coverage = [0] * (len(children) + 1)
+    open_starts = {}
+    zones = 0
+    for idx, element in enumerate(children):
+        markers = markers_of(element)
+        if not markers:
+            continue
+        is_marker[idx] = True
+        for segment_num, is_start in markers:
+            if is_start:
+                open_starts.setdefault(segment_num, idx)
+            elif segment_num in open_starts:
+                start_idx = open_starts.pop(segment_num)
+                if segment_num not in present_segments:
+                    coverage[start_idx] += 1
+                    coverage[idx + 1] -= 1
+                    zones += 1
+
+    # Single sweep: drop covered elements and every marker paragraph
+    removed = 0
+    depth = 0
+    for idx, element in enumerate(children):
+        depth += coverage[idx]
+        if depth > 0 or is_marker[idx]:
+            body.remove(element)
+            removed += 1
+
+    # Markers inside tables or textboxes are stripped rather than removed
+    markers = {}
     for segment_num in range(1, 7):
-        start_marker = f"{{{{Segment{segment_num}_Start}}}}"
-        end_marker = f"{{{{Segment{segment_num}_End}}}}"
-        
-        # Remove from paragraphs
-        for paragraph in doc.paragraphs:
-            if start_marker in paragraph.text or end_marker in paragraph.text:
-                p = paragraph._element
-                if p.getparent() is not None:
-                    p.getparent().remove(p)
-                    current_app.logger.info(f"Removed marker: {paragraph.text}")
-        
-        # Remove from tables
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        if start_marker in paragraph.text:
-                            paragraph.text = paragraph.text.replace(start_marker, '')
-                        if end_marker in paragraph.text:
-                            paragraph.text = paragraph.text.replace(end_marker, '')
-
-def update_document_references(doc):
+        markers[f"{{{{Segment{segment_num}_Start}}}}"] = ''
+        markers[f"{{{{Segment{segment_num}_End}}}}"] = ''
+    pattern = compile_replacements(markers)
+    nested = (
+        bound.element for bound in placeholders
+        if not bound.body_level and not bound.tokens.isdisjoint(markers)
+    )
+    stripped = 0
+    for element in nested:
+        stripped += _splice_text_nodes(paragraph_text_nodes(element), pattern, markers)
+
+    current_app.logger.info(
+        f"Removed {zones} unused segment sections ({removed} body elements including markers), "
+        f"stripped {stripped} nested markers"
+    )
+    return removed
+
+# Fields whose results depend on document structure: tables of contents,
+# figures and tables, cross-references and caption numbering
+REFERENCE_FIELD_TYPES = ('TOC', 'TOF', 'TOT', 'REF', 'PAGEREF', 'SEQ')
+
+def update_document_references(doc, fields, structure_changed=True):
     """
     Updates Table of Contents, List of Figures, and List of Tables in a Word document.
     Uses Word field codes to force an update of these elements.
     
+    Each reference field is marked dirty through its begin fldChar (or its
+    fldSimple element), so Word recomputes it on open. Fields come from the
+    template's field index.
+    
     Args:
         doc: The Word document object
+        fields (list): (element, field type) pairs bound from the field index
+        structure_changed (bool): False when nothing was removed and no heading or
+            caption text changed, in which case the stored field results are still valid
+        
+    Returns:
+        int: Number of fields marked for update
     """
+    if not structure_changed:
+        current_app.logger.info("Document structure unchanged, skipping reference field update")
+        return 0
+
     try:
-        # XML namespace for Word documents
-        namespace = {
-            'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
-        }
-        
-        # Function to update specific field type
-        def update_fields(field_type):
-            # Find all fields of the specified type
-            elements = doc.element.body.findall(
-                f'.//w:fldChar/..',  # Parent of fldChar
-                namespace
-            )
-            
-            current_app.logger.info(f"Found {len(elements)} potential field elements")
-            
-            for element in elements:
-                # Get the field code text
-                field_codes = element.findall('.//w:instrText', namespace)
-                if not field_codes:
-                    continue
-                    
-                field_text = ' '.join(code.text for code in field_codes if code.text)
-                
-                # Check if this is the type of field we want to update
-                if field_type in field_text:
-                    current_app.logger.info(f"Updating {field_type}")
-                    
-                    # Find the fldChar elements
-                    fld_chars = element.findall('.//w:fldChar', namespace)
-                    
-                    # Update the field status
-                    for fld_char in fld_chars:
-                        fld_char_type = fld_char.get(f'{{{namespace["w"]}}}fldCharType', '')
-                        if fld_char_type == 'begin':
-                            # Set dirty attribute to trigger update
-                            fld_char.set(f'{{{namespace["w"]}}}dirty', 'true')
-                            current_app.logger.info(f"Marked {field_type} field as dirty for update")
-        
-        # Update Table of Contents
-        update_fields('TOC')
-        
-        # Update List of Figures
-        update_fields('TOF')
-        
-        # Update List of Tables
-        update_fields('TOT')
-        
-        # Additional update for any other potential field codes
-        for field_type in ['REF', 'PAGEREF', 'SEQ']:
-            update_fields(field_type)
-            
-        current_app.logger.info("Document references update complete")
+        updated = 0
+        for element, field_type in fields:
+            if field_type in REFERENCE_FIELD_TYPES:
+                element.set(W_DIRTY, 'true')
+                updated += 1
+
+        current_app.logger.info(f"Marked {updated} reference fields for update")
+        return updated
         
     except Exception as e:
         current_app.logger.error(f"Error updating document references: {str(e)}")
         raise
 
-def store_document_data(db, user_id, input_data, filename, template_type, generation_type="single"):
+def store_document_data(db, user_id, input_data, filename, template_type, generation_type="single", status="completed",
+                        deadline=None):
     """
     Store document generation data in MongoDB.
     
@@ -464,6 +475,8 @@ def store_document_data(db, user_id, input_data, filename, template_type, genera
         filename: Name of the generated document
         template_type: Type of template used (Global, Regional, Country)
         generation_type: Type of generation (single or bulk)
+        status: Initial status; "queued" for asynchronous jobs
+        deadline: UTC time by which an asynchronous job must have finished
     """
     document_record = {
         "user_id": ObjectId(user_id),
@@ -472,8 +485,10 @@ def store_document_data(db, user_id, input_data, filename, template_type, genera
         "template_type": template_type,
         "generation_type": generation_type,
         "created_at": datetime.now(pytz.timezone('Asia/Kolkata')).isoformat(),  # IST timezone
-        "status": "completed"
+        "status": status
     }
+    if deadline is not None:
+        document_record["deadline"] = deadline
     
     try:
         result = db.documents.insert_one(document_record)
@@ -482,37 +497,51 @@ def store_document_data(db, user_id, input_data, filename, template_type, genera
         current_app.logger.error(f"Error storing document data: {str(e)}")
         raise
 
-def replace_header_textbox(doc, market_name, location):
+def get_header_location(data):
+    """Return the value shown for {{region}}/{{country}} in header textboxes."""
+    template_type = data.get("template_type", "Global")
+    if template_type == "Country":
+        return data.get("country", "")
+    if template_type == "Regional":
+        return data.get("region", "")
+    return "Global"
+
+# Textbox markup used by replace_header_textbox, compiled once per process
+HEADER_NAMESPACES = {
+    'w': W_NS,
+    'v': V_NS,
+    'a': A_NS,
+    'wp': 'http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing'
+}
+# VML textboxes, DrawingML textboxes (bare, in wps shapes or in mc:AlternateContent)
+HEADER_TEXTBOX_PARAGRAPHS_XPATH = etree.XPath(
+    './/v:textbox//w:p | .//w:txbxContent//w:p', namespaces=HEADER_NAMESPACES
+)
+# DrawingML text over images, inline or anchored
+HEADER_DRAWING_TEXT_XPATH = etree.XPath('.//a:p//a:r//a:t', namespaces=HEADER_NAMESPACES)
+HEADER_RUNS_XPATH = etree.XPath('.//w:r', namespaces=HEADER_NAMESPACES)
+HEADER_RUN_TEXT_XPATH = etree.XPath('.//w:t', namespaces=HEADER_NAMESPACES)
+HEADER_SPLIT_PLACEHOLDER_PATTERN = re.compile(r'\{\{\s*(mar|reg|cou)[^{}]*\}\}')
+
+def replace_header_textbox(doc, market_name, location, header_parts=None):
     """
     Replace placeholders {{region}}/{{country}} and {{market_name}} in textboxes located 
     in headers, particularly those positioned above images.
     
+    The header parts of the in-memory document are edited directly, so the
+    document only needs to be serialized once afterwards.
+    
     Parameters:
-        doc (str): Path to the Word document
+        doc: The Word document object
         market_name (str): The market name to replace {{market_name}} placeholder
         location (str): The region or country name to replace {{region}} or {{country}} placeholder
+        header_parts (list, optional): Header parts to process, typically those the
+            template's part index found to contain textboxes; defaults to every header
     
     Returns:
-        str: Path to the modified document
+        bool: True if any header was modified
     """
-    import os
-    import re
-    import zipfile
-    from lxml import etree
-    import shutil
-    
-    # Import Flask current_app if available, otherwise create a fallback logger
-    try:
-        from flask import current_app
-        logger = current_app.logger
-    except ImportError:
-        import logging
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
-        logger = logging.getLogger(__name__)
-    
+    logger = current_app.logger
     logger.info(f"Starting header textbox replacement: market_name={market_name}, location={location}")
     
     # Build the replacements dictionary
@@ -528,27 +557,7 @@ def replace_header_textbox(doc, market_name, location):
     # Exit early if no replacements needed
     if not replacements:
         logger.warning("No replacement values provided")
-        return doc
-    
-    # Handle different input types
-    is_path = isinstance(doc, str)
-    doc_path = None
-    
-    if is_path:
-        # It's a file path
-        doc_path = doc
-        base, ext = os.path.splitext(doc_path)
-        output_path = f"{base}_filled{ext}"
-        # Create a copy of the document to work with
-        shutil.copy2(doc_path, output_path)
-        working_path = output_path
-    else:
-        # It's a Document object, save to temp file
-        import tempfile
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.docx')
-        working_path = temp_file.name
-        temp_file.close()
-        doc.save(working_path)
+        return False
     
     # Add alternate forms of the placeholders
     expanded_replacements = replacements.copy()
@@ -556,210 +565,529 @@ def replace_header_textbox(doc, market_name, location):
         # Remove curly braces for alternate form
         alt_key = placeholder.replace('{{', '').replace('}}', '')
         # Create alternate forms
-        expanded_replacements[f"{{{{{alt_key}}}}}"] = value
         expanded_replacements[f"{{ {{{alt_key}}} }}"] = value
-        expanded_replacements[f"{{{{{alt_key.replace('_', '')}}}}}"] = value  # No underscores
         expanded_replacements[alt_key] = value  # Plain text version
         
         # Variant with no underscore and alternative casing
         no_underscore = alt_key.replace('_', '')
         expanded_replacements[f"{{{{{no_underscore}}}}}"] = value
-        expanded_replacements[f"{{{{{no_underscore.lower()}}}}}" ] = value
+        expanded_replacements[f"{{{{{no_underscore.lower()}}}}}"] = value
         
         logger.debug(f"Expanded placeholders for {placeholder}: {expanded_replacements}")
     
-    # Word document XML namespaces
-    namespaces = {
-        'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
-        'v': 'urn:schemas-microsoft-com:vml',
-        'wp': 'http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing',
-        'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
-        'mc': 'http://schemas.openxmlformats.org/markup-compatibility/2006',
-        'wps': 'http://schemas.microsoft.com/office/word/2010/wordprocessingShape',
-        'wpg': 'http://schemas.microsoft.com/office/word/2010/wordprocessingGroup',
-        'w14': 'http://schemas.microsoft.com/office/word/2010/wordml',
-        'a14': 'http://schemas.microsoft.com/office/drawing/2010/main',
-        'pic': 'http://schemas.openxmlformats.org/drawingml/2006/picture',
-        'o': 'urn:schemas-microsoft-com:office:office',
-        'w10': 'urn:schemas-microsoft-com:office:word',
-        'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+    # One alternation for every form, longest first, cached per set of forms
+    pattern = compile_replacements(expanded_replacements)
+    
+    def replace_direct(text):
+        return pattern.sub(lambda match: expanded_replacements[match.group(0)], text)
+    
+    # Placeholders mangled inside the braces (e.g. "{{regoin}}"), matched on their prefix
+    split_values = {
+        'mar': market_name or None,
+        'reg': location or None,
+        'cou': location or None
     }
     
-    # Helper function to extract paragraph text
-    def extract_paragraph_text(paragraph):
-        text = ""
-        for run in paragraph.xpath('.//w:r', namespaces=namespaces):
-            for text_elem in run.xpath('.//w:t', namespaces=namespaces):
-                if text_elem.text:
-                    text += text_elem.text
-        return text
-    
-    # Helper function to check if paragraph contains any placeholder
-    def contains_any_placeholder(text, placeholders):
-        # Direct matching
-        for placeholder in placeholders:
-            if placeholder in text:
-                return True
-        
-        # Check for split placeholders (e.g., "{{reg" "ion}}")
-        for placeholder in placeholders:
-            if placeholder.startswith('{{') and '{{' in text:
-                placeholder_core = placeholder.strip('{}')
-                # Check if any substantial part of the placeholder exists
-                if len(placeholder_core) > 3 and placeholder_core[:3] in text:
-                    return True
-        
-        return False
+    def replace_split(match):
+        value = split_values[match.group(1)]
+        return match.group(0) if value is None else value
+    
+    any_modified = False
     
-    # Process the document
-    with zipfile.ZipFile(output_path, mode='a') as zip_file:
-        # Process headers
-        for i in range(1, 4):  # Usually Word docs have up to 3 headers
-            header_path = f'word/header{i}.xml'
+    if header_parts is None:
+        header_parts = iter_header_parts(doc)
+    
+    # Process headers
+    for header_part in header_parts:
+        header_path = str(header_part.partname)
+        
+        try:
+            logger.info(f"Processing header: {header_path}")
             
-            try:
-                # Skip if header doesn't exist
-                if header_path not in zip_file.namelist():
+            root = header_part.element
+            
+            header_modified = False
+            
+            # Paragraphs of VML, DrawingML, shape and alternate content textboxes,
+            # each once and in document order
+            for paragraph in HEADER_TEXTBOX_PARAGRAPHS_XPATH(root):
+                paragraph_text = ''.join(paragraph.itertext(W_T))
+                if not paragraph_text:
                     continue
                 
-                logger.info(f"Processing header: {header_path}")
+                # Replace all placeholders in the text
+                processed_text = replace_direct(paragraph_text)
                 
-                # Extract the XML content
-                xml_content = zip_file.read(header_path)
-                root = etree.fromstring(xml_content)
+                # If no direct replacements were made, try for split placeholders
+                if processed_text == paragraph_text and '{{' in paragraph_text:
+                    processed_text = HEADER_SPLIT_PLACEHOLDER_PATTERN.sub(replace_split, paragraph_text)
                 
-                header_modified = False
+                # Skip if no changes needed
+                if processed_text == paragraph_text:
+                    continue
                 
-                # Process different types of textboxes
-                textbox_paths = [
-                    # VML textboxes often used in older Word docs
-                    ('.//v:textbox//w:p', "VML textbox"),
-                    # DrawingML textboxes 
-                    ('.//w:txbxContent//w:p', "DrawingML textbox"),
-                    # Shapes with textboxes
-                    ('.//wps:wsp//wps:txbx//w:txbxContent//w:p', "shape textbox"),
-                    # Alternate content (compatibility mode)
-                    ('.//mc:AlternateContent//w:txbxContent//w:p', "alternate content textbox")
-                ]
+                logger.info(f"Found placeholder in textbox: {paragraph_text}")
+                logger.info(f"Replacing with: {processed_text}")
                 
-                # Process each type of textbox
-                for xpath, context in textbox_paths:
-                    for paragraph in root.xpath(xpath, namespaces=namespaces):
-                        paragraph_text = extract_paragraph_text(paragraph)
-                        
-                        # Skip if no placeholders found
-                        if not contains_any_placeholder(paragraph_text, expanded_replacements.keys()):
-                            continue
-                        
-                        logger.info(f"Found placeholder in {context}: {paragraph_text}")
-                        
-                        # Replace all placeholders in the text
-                        processed_text = paragraph_text
-                        for placeholder, replacement in expanded_replacements.items():
-                            if placeholder in processed_text:
-                                processed_text = processed_text.replace(placeholder, replacement)
-                                logger.debug(f"Replaced '{placeholder}' with '{replacement}'")
-                        
-                        # If no direct replacements were made, try for split placeholders
-                        if processed_text == paragraph_text:
-                            logger.debug(f"Attempting to handle split placeholders in {context}")
-                            
-                            for placeholder, replacement in expanded_replacements.items():
-                                if placeholder.startswith('{{') and '{{' in paragraph_text:
-                                    placeholder_core = placeholder.strip('{}')
-                                    # Look for fragments of the placeholder
-                                    for i in range(3, len(placeholder_core), 3):
-                                        fragment = placeholder_core[:i]
-                                        if fragment in paragraph_text:
-                                            start_pos = paragraph_text.find(fragment)
-                                            # Check if this is likely the start of our placeholder
-                                            prefix = paragraph_text[max(0, start_pos-2):start_pos]
-                                            if '{{' in prefix or start_pos < 2:
-                                                logger.debug(f"Found fragment '{fragment}' of placeholder '{placeholder}'")
-                                                # Replace the placeholder and surrounding braces
-                                                before = max(0, paragraph_text.rfind('{{', 0, start_pos+1))
-                                                after = paragraph_text.find('}}', start_pos)
-                                                if after > -1:
-                                                    processed_text = (paragraph_text[:before] + 
-                                                                      replacement + 
-                                                                      paragraph_text[after+2:])
-                                                    break
-                        
-                        # Skip if no changes needed
-                        if processed_text == paragraph_text:
-                            continue
-                            
-                        logger.info(f"Replacing with: {processed_text}")
+                # Update the text content
+                runs = HEADER_RUNS_XPATH(paragraph)
+                if runs:
+                    # Put all content in first run and clear others
+                    text_elements = HEADER_RUN_TEXT_XPATH(runs[0])
+                    
+                    if text_elements:
+                        text_elements[0].text = processed_text
+                        # Clear other text elements to avoid duplicated content
+                        for text_elem in text_elements[1:]:
+                            text_elem.text = ""
+                        for run in runs[1:]:
+                            for text_elem in HEADER_RUN_TEXT_XPATH(run):
+                                text_elem.text = ""
                         
-                        # Update the text content
-                        runs = paragraph.xpath('.//w:r', namespaces=namespaces)
-                        if runs:
-                            # Put all content in first run and clear others
-                            first_run = runs[0]
-                            text_elements = first_run.xpath('.//w:t', namespaces=namespaces)
-                            
-                            if text_elements:
-                                text_elements[0].text = processed_text
-                                # Clear other runs to avoid duplicated content
-                                for run in runs[1:]:
-                                    for text_elem in run.xpath('.//w:t', namespaces=namespaces):
-                                        text_elem.text = ""
-                                
-                                header_modified = True
-                                logger.info(f"Updated content in {context}")
+                        header_modified = True
+                        logger.info("Updated content in textbox")
+            
+            # Handle DrawingML text elements (often used for text over images)
+            for text_elem in HEADER_DRAWING_TEXT_XPATH(root):
+                if not text_elem.text:
+                    continue
                 
-                # Handle DrawingML text elements (often used for text over images)
-                drawing_text_paths = [
-                    ('.//a:p//a:r//a:t', 'DrawingML text'),
-                    ('.//wp:inline//a:p//a:r//a:t', 'Inline drawing text'),
-                    ('.//wp:anchor//a:p//a:r//a:t', 'Anchored drawing text')
-                ]
+                original_text = text_elem.text
+                modified_text = replace_direct(original_text)
                 
-                for xpath, context in drawing_text_paths:
-                    for text_elem in root.xpath(xpath, namespaces=namespaces):
-                        if not text_elem.text:
-                            continue
-                            
-                        original_text = text_elem.text
-                        modified_text = original_text
-                        
-                        # Check for direct replacements
-                        placeholder_found = False
-                        for placeholder, replacement in expanded_replacements.items():
-                            if placeholder in modified_text:
-                                modified_text = modified_text.replace(placeholder, replacement)
-                                placeholder_found = True
-                                logger.info(f"Found placeholder {placeholder} in {context}")
-                        
-                        # Update single text element if modified
-                        if original_text != modified_text:
-                            text_elem.text = modified_text
-                            header_modified = True
-                            logger.info(f"Updated text in {context} from '{original_text}' to '{modified_text}'")
-                
-                # If changes were made, update the header in the zip file
-                if header_modified:
-                    updated_xml = etree.tostring(root, encoding='UTF-8', xml_declaration=True)
-                    zip_file.writestr(header_path, updated_xml)
-                    logger.info(f"Updated content in header {header_path}")
+                # Update single text element if modified
+                if original_text != modified_text:
+                    text_elem.text = modified_text
+                    header_modified = True
+                    logger.info(f"Updated DrawingML text from '{original_text}' to '{modified_text}'")
             
-            except Exception as e:
-                logger.error(f"Error processing header {header_path}: {str(e)}", exc_info=True)
+            if header_modified:
+                any_modified = True
+                logger.info(f"Updated content in header {header_path}")
+        
+        except Exception as e:
+            logger.error(f"Error processing header {header_path}: {str(e)}", exc_info=True)
+    
+    logger.info("Header textbox processing completed")
+    return any_modified
+
+
+
+def segment_presence(data):
+    """
+    Encode which segment and sub-segment slots a request fills as a bitmap.
     
-    logger.info(f"Document processing completed, output saved to {output_path}")
-    return output_path
+    Each of the six segments takes 11 bits - one for the SegmentN key and one
+    per sub-segment key - followed by one bit per segment with a non-empty
+    name. Company slots are always substituted (blank when unfilled), so they
+    never change the document structure and are not part of the bitmap.
+    
+    Args:
+        data (dict): Request payload (single generation JSON or a bulk CSV row)
+        
+    Returns:
+        int: The presence bitmap
+    """
+    presence = 0
+    for i in range(1, 7):
+        base = (i - 1) * 11
+        if f"Segment{i}" in data:
+            presence |= 1 << base
+        for j in range(1, 11):
+            if f"Segment{i}Sub-segment{j}" in data:
+                presence |= 1 << (base + j)
+        if data.get(f"Segment{i}"):
+            presence |= 1 << (66 + i - 1)
+    return presence
+
+def prune_template(instance, data):
+    """
+    Apply the structural passes for a request's segment shape to a template copy.
+    
+    Paragraphs and table rows with segment placeholders the request leaves
+    unfilled are removed, then the sections of absent segments and all segment
+    markers. Neither pass looks at placeholder values, so the result is cached
+    as a skeleton per presence bitmap (see segment_presence).
+    
+    Args:
+        instance: TemplateInstance of an unpruned template copy
+        data (dict): Any request payload with this segment shape
+        
+    Returns:
+        bool: True if anything was removed
+    """
+    doc, placeholders = instance.doc, instance.placeholders
+    segmentations = build_segmentations(data)
+    current_app.logger.info(f"Converted segmentations: {segmentations}")
+
+    filled = {
+        placeholder for placeholder in build_replacements(data)
+        if RESIDUAL_SEGMENT_PATTERN.fullmatch(placeholder)
+    }
 
+    # Clean empty paragraphs and table rows
+    cleaned = clean_empty_segments(doc, placeholders, filled=filled)
 
+    # Remove unused sections and clean markers
+    removed = remove_unused_sections(doc, segmentations, placeholders)
 
-def log_placeholders(doc):
-    """Log all placeholders found in the document for debugging."""
-    for paragraph in doc.paragraphs:
-        current_app.logger.info(f"Paragraph text: {paragraph.text}")
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    current_app.logger.info(f"Table cell text: {paragraph.text}")
+    return bool(cleaned['paragraphs'] or cleaned['rows'] or removed)
+
+def load_document(template_path, data, presence=None):
+    """
+    Return a TemplateInstance for data, cloned from the skeleton matching its
+    segment shape. presence may be passed when already known for data.
+    """
+    if presence is None:
+        presence = segment_presence(data)
+    return load_template(template_path, presence, partial(prune_template, data=data))
+
+def populate_document(instance, data):
+    """
+    Fill a request's copy of a template from the input data.
+    
+    The copy comes from a skeleton already pruned for the request's segment
+    shape (see load_document), so only value-dependent work is left: the
+    single-pass placeholder substitution, reference field updates and the
+    header textbox pass.
+    
+    Args:
+        instance: TemplateInstance returned by load_document
+        data (dict): Request payload (single generation JSON or a bulk CSV row)
+    """
+    doc, placeholders = instance.doc, instance.placeholders
+
+    # Substitute every placeholder (region/country, market name, segments,
+    # sub-segments and companies) in a single pass over the document
+    replacements = build_replacements(data)
+    replace_placeholders(doc, replacements, placeholders)
+
+    # Reference fields only go stale if content moved or heading/caption text changed
+    headings_changed = any(
+        bound.heading and not bound.tokens.isdisjoint(replacements)
+        for bound in placeholders
+    )
+    update_document_references(
+        doc,
+        instance.fields,
+        structure_changed=instance.template.pruned or headings_changed
+    )
+
+    # Fill header textboxes in place
+    location = get_header_location(data)
+    if location:
+        replace_header_textbox(
+            doc, data.get("market_name", ""), location,
+            header_parts=instance.template.parts.textbox_parts(doc, ('header',))
+        )
+
+def output_payload(data):
+    """
+    Normalize a request payload to what determines the generated document:
+    the placeholder values, the segment shape and the header textbox values.
+    Key order, unrelated keys and values of unused slots do not matter.
+    """
+    return {
+        'replacements': build_replacements(data),
+        'presence': segment_presence(data),
+        'header': [data.get("market_name", ""), get_header_location(data)]
+    }
+
+def document_output_key(template_path, data):
+    """Return the output cache key of the document data generates from a template."""
+    template = template_cache.get(template_path)
+    return output_key(template.content_hash, output_payload(data))
+
+def render_document(template_path, data, key=None):
+    """
+    Generate the .docx bytes for a request, serving repeats from the output cache.
+    
+    Args:
+        template_path (str): Path to the .docx template
+        data (dict): Request payload
+        key (str, optional): Output cache key of the document, if already known
+        
+    Returns:
+        tuple: (bytes of the document, True if it came from the cache)
+    """
+    if key is None:
+        key = document_output_key(template_path, data)
+    blob = output_cache.get(key)
+    if blob is not None:
+        current_app.logger.info(f"Serving cached document {key[:12]}")
+        return blob, True
+
+    # Clone the cached, pre-parsed template for this request
+    instance = load_document(template_path, data)
+    log_placeholders(instance.template)
+    populate_document(instance, data)
+
+    # Serialize exactly once
+    buffer = BytesIO()
+    instance.doc.save(buffer)
+    blob = buffer.getvalue()
+    output_cache.put(key, blob)
+    return blob, False
+
+def log_placeholders(template):
+    """Log the placeholder manifest of a compiled template for debugging."""
+    for token, info in template.placeholders.manifest().items():
+        current_app.logger.info(
+            f"Placeholder {token}: {info['occurrences']} occurrence(s) in {', '.join(info['parts'])}"
+        )
+
+@bp.route('/templates/manifest', methods=['GET'])
+def get_template_manifest():
+    """Return the placeholder manifest of a template: where each {{...}} token occurs."""
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({"message": "Token is required"}), 401
+
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({"message": "Invalid token"}), 401
+
+    template_type = request.args.get("template_type", "Global")
+    try:
+        template_path = get_template_path(
+            template_type,
+            region=request.args.get("region") if template_type == "Regional" else None
+        )
+        template = template_cache.get(template_path)
+    except FileNotFoundError as e:
+        return jsonify({'message': 'Template file not found', 'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'message': 'Invalid template type or region', 'error': str(e)}), 400
+
+    return jsonify({
+        "template": os.path.basename(template_path),
+        "content_hash": template.content_hash,
+        "parts": template.parts.summary(),
+        "placeholders": template.placeholders.manifest()
+    }), 200
+
+def document_filename(data):
+    """Generate the download filename based on template type."""
+    template_type = data.get("template_type", "Global")
+    market_name = data.get("market_name", "")
+    if template_type == "Regional":
+        return f'{data.get("region")} {market_name} Market.docx'
+    elif template_type == "Country":
+        return f'{data.get("country")} {market_name} Market.docx'
+    else:  # Global template
+        return f'Global {market_name} Market.docx'
+
+def job_deadline():
+    """UTC time by which a job queued or started now must have finished."""
+    return datetime.utcnow() + timedelta(seconds=current_app.config.get('GENERATION_JOB_TIMEOUT_SECONDS', 600))
+
+def enqueue_generation(db, user, template_path, data):
+    """
+    Record a queued document and generate it on the background executor.
+    
+    The documents record doubles as the job: its status moves from queued to
+    processing to completed or failed, and the finished document is kept in
+    the output cache under the key stored on the record. Jobs live only in
+    this worker's executor, so the record carries a deadline after which a
+    job lost to a worker restart is reported failed (see expire_stale_job).
+    
+    Returns:
+        tuple: 202 response with the job id and its status and download URLs
+    """
+    job_id = store_document_data(
+        db=db,
+        user_id=user['_id'],
+        input_data=data,
+        filename=document_filename(data),
+        template_type=data.get("template_type", "Global"),
+        status="queued",
+        deadline=job_deadline()
+    )
+    jobs.submit(current_app._get_current_object(), run_generation_job, job_id, template_path, data)
+    current_app.logger.info(f"Queued document job {job_id} for user {user['username']}")
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"{bp.url_prefix}/jobs/{job_id}",
+        "download_url": f"{bp.url_prefix}/jobs/{job_id}/download"
+    }), 202
+
+def run_generation_job(job_id, template_path, data):
+    """
+    Generate a queued document and record the outcome on its documents record.
+
+    Each transition only applies from the status it expects, so a job that
+    expired while waiting in the executor queue is skipped, and one that
+    expired while running is not reported completed afterwards.
+    """
+    db = get_database()
+    job_id = ObjectId(job_id)
+    started = db.documents.update_one({"_id": job_id, "status": "queued"}, {"$set": {
+        "status": "processing",
+        "started_at": datetime.now(pytz.timezone('Asia/Kolkata')).isoformat(),
+        "deadline": job_deadline()
+    }})
+    if not started.matched_count:
+        current_app.logger.warning(f"Document job {job_id} is no longer queued, skipping it")
+        return
+    job_filter = {"_id": job_id, "status": "processing"}
+    try:
+        key = document_output_key(template_path, data)
+        blob, _ = render_document(template_path, data, key)
+        db.documents.update_one(job_filter, {"$set": {
+            "status": "completed",
+            "output_key": key,
+            "size": len(blob),
+            "completed_at": datetime.now(pytz.timezone('Asia/Kolkata')).isoformat()
+        }})
+        current_app.logger.info(f"Document job {job_id} completed")
+    except Exception as e:
+        current_app.logger.error(f"Document job {job_id} failed: {traceback.format_exc()}")
+        db.documents.update_one(job_filter, {"$set": {"status": "failed", "error": str(e)}})
+
+def expire_stale_job(db, record):
+    """
+    Mark a queued or processing job failed once its deadline has passed.
+
+    The executor is in-process, so a worker timeout, restart or deploy drops
+    its jobs without a trace; without this their records would stay queued
+    or processing forever. record is updated in place.
+    """
+    deadline = record.get("deadline")
+    if record.get("status") not in ("queued", "processing") or not deadline or deadline > datetime.utcnow():
+        return
+    error = "Job did not finish in time; the worker running it may have restarted"
+    db.documents.update_one(
+        {"_id": record["_id"], "status": record["status"]},
+        {"$set": {"status": "failed", "error": error}}
+    )
+    current_app.logger.warning(f"Document job {record['_id']} expired while {record['status']}")
+    record["status"] = "failed"
+    record["error"] = error
+
+def _find_job(db, job_id, user):
+    """Return the documents record of a job if user may see it, else an error response."""
+    try:
+        record = db.documents.find_one({"_id": ObjectId(job_id)})
+    except Exception:
+        record = None
+    if not record:
+        return None, (jsonify({"message": "Job not found"}), 404)
+    if str(record["user_id"]) != str(user["_id"]) and user.get("role") != "admin":
+        return None, (jsonify({"message": "Unauthorized"}), 403)
+    expire_stale_job(db, record)
+    return record, None
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Return the status of an asynchronous generation job."""
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({"message": "Token is required"}), 401
+
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({"message": "Invalid token"}), 401
+
+    db, client = get_db()
+    record, error = _find_job(db, job_id, user)
+    if error:
+        return error
+
+    return jsonify({
+        "job_id": job_id,
+        "status": record.get("status"),
+        "filename": record.get("filename"),
+        "created_at": record.get("created_at"),
+        "started_at": record.get("started_at"),
+        "completed_at": record.get("completed_at"),
+        "error": record.get("error")
+    }), 200
+
+@bp.route('/jobs/<job_id>/download', methods=['GET'])
+def download_job(job_id):
+    """Download the document of a completed asynchronous generation job."""
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({"message": "Token is required"}), 401
+
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({"message": "Invalid token"}), 401
+
+    db, client = get_db()
+    record, error = _find_job(db, job_id, user)
+    if error:
+        return error
+    if record.get("status") != "completed":
+        return jsonify({"message": "Job is not completed", "status": record.get("status")}), 409
+
+    try:
+        blob = output_cache.get(record["output_key"]) if record.get("output_key") else None
+        if blob is None:
+            # Evicted, or generated on another host: generation is deterministic, so redo it
+            data = record["input_data"]
+            template_type = data.get("template_type", "Global")
+            template_path = get_template_path(
+                template_type,
+                region=data.get("region") if template_type == "Regional" else None
+            )
+            blob, cache_hit = render_document(template_path, data)
+
+        return send_file(
+            BytesIO(blob),
+            mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            download_name=record["filename"],
+            as_attachment=True
+        )
+    except Exception as e:
+        current_app.logger.error(f"Error downloading job {job_id}: {traceback.format_exc()}")
+        return jsonify({'message': 'Error downloading document', 'error': str(e)}), 500
+
+def _require_admin():
+    """Return an error response unless the request carries an admin token."""
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({"message": "Token is required"}), 401
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({"message": "Invalid token"}), 401
+    if user['role'] != 'admin':
+        return jsonify({"message": "Unauthorized"}), 403
+    return None
+
+@bp.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Return hit/miss counters and sizes of this worker's template, output and user caches."""
+    error = _require_admin()
+    if error:
+        return error
+    return jsonify({
+        "pid": os.getpid(),
+        "templates": template_cache.stats(),
+        "skeletons": skeleton_cache.stats(),
+        "output": output_cache.stats(),
+        "users": user_cache.stats(),
+        "revoked_users": revoked_users.stats()
+    }), 200
+
+@bp.route('/cache/purge', methods=['POST'])
+def purge_output_cache():
+    """
+    Purge generated documents from the shared disk tier and from the memory
+    tier of every worker on this host (the others drop theirs on their next
+    lookup). Other hosts keep their own caches.
+    """
+    error = _require_admin()
+    if error:
+        return error
+    try:
+        purged = output_cache.purge()
+        current_app.logger.info(f"Output cache purged: {purged}")
+        return jsonify({"message": "Output cache purged", **purged}), 200
+    except Exception as e:
+        current_app.logger.error(f"Error purging output cache: {str(e)}")
+        return jsonify({"message": f"Error: {str(e)}"}), 500
 
 @bp.route('/generate', methods=['POST'])
 def generate_word_doc():
@@ -800,119 +1128,34 @@ def generate_word_doc():
             region=data.get("region") if template_type == "Regional" else None
         )
         
-        # Load the template document
-        doc = Document(template_path)
-        log_placeholders(doc)
-
-        
-
-        # Handle region-specific content for Regional template
+        # Validate region/country before touching the document
         if template_type == "Regional":
             region = data.get("region")
             if not region:
                 raise ValueError("Region is required for Regional template")
-            region = validate_region(region)
-            replace_region(doc, region)
-
-                       
-
-        # Handle country-specific content for Country template
-        if template_type == "Country":
-            country = data.get("country")
-            if not country:
+            validate_region(region)
+        elif template_type == "Country":
+            if not data.get("country"):
                 raise ValueError("Country is required for Country template")
-            replace_country(doc, country)
-            
-            
-            
-        # Extract market_name
-        market_name = data.get("market_name", "")
-        if market_name:
-            replace_text(doc, "{{market_name}}", market_name)
-            replace_textbox_text(doc, "{{market_name}}", market_name)
-            template_type = data.get("template_type", "Global")
-           
-                  
-            
-        # Convert flat dictionary to structured segmentations
-        segmentations = []
-        i = 1
-        while f"Segment{i}" in data:
-            segment_name = data[f"Segment{i}"]
-            sub_segments = []
-            j = 1
-            while f"Segment{i}Sub-segment{j}" in data:
-                sub_segments.append(data[f"Segment{i}Sub-segment{j}"])
-                j += 1
-            segmentations.append({"name": segment_name, "subSegments": sub_segments})
-            i += 1
-
-        current_app.logger.info(f"Converted segmentations: {segmentations}")
-
-        # Replace segments in the document
-        replace_segments(doc, segmentations)
-
-        # Clean empty paragraphs and table rows
-        clean_empty_segments(doc, segmentations)
-        
-        # Replace company names
-        companies = [data.get(f"Company{i+1}", "") for i in range(10)]
-        replace_companies(doc, companies)
-
-        # Remove unused sections and clean markers
-        remove_unused_sections(doc, segmentations)
-        clean_all_segment_markers(doc)
-
-        update_document_references(doc)
 
+        # Opt-in asynchronous mode: queue the job and answer right away
+        if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+            if current_app.config.get('SERVERLESS'):
+                # Background threads are frozen once the response is returned
+                return jsonify({
+                    'message': 'Asynchronous generation is not available on this deployment; retry without async=1'
+                }), 400
+            return enqueue_generation(db, user, template_path, data)
 
-       # Create the temporary file first
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.docx')
-        temp_path = temp_file.name
-        temp_file.close()
-        doc.save(temp_path)
+        # Serve identical regenerations from the output cache
+        blob, cache_hit = render_document(template_path, data)
+        in_memory_file = BytesIO(blob)
 
-        # Now handle the textbox replacements based on template type
         market_name = data.get("market_name", "")
-        updated_path = None
-
-        if template_type == "Country":
-            country = data.get("country", "")
-            if country:  # Only proceed if country exists
-                updated_path = replace_header_textbox(temp_path, market_name, country)
-        elif template_type == "Global":
-            global_sample = "Global"
-            updated_path = replace_header_textbox(temp_path, market_name, global_sample)
-        elif template_type == "Regional":
-            region = data.get("region", "")
-            if region:  # Only proceed if region exists
-                updated_path = replace_header_textbox(temp_path, market_name, region)
-
-        # Process the updated document if successful
-        if updated_path and os.path.exists(updated_path):
-            doc = Document(updated_path)
-            # Clean up temp files
-            os.remove(temp_path)
-            os.remove(updated_path)
-        else:
-            # If no successful update, use the original temp document
-            doc = Document(temp_path)
-        
-        # Save the updated document to an in-memory file
-        in_memory_file = BytesIO()
-        doc.save(in_memory_file)
-        in_memory_file.seek(0)
-
         current_app.logger.info(f"Document generated successfully by user {user['username']} using {template_type} template")
         current_app.logger.info(f"Market Name: {market_name}")
         
-       # Generate filename based on template type
-        if template_type == "Regional":
-            filename = f'{data.get("region")} {market_name} Market.docx'
-        elif template_type == "Country":
-            filename = f'{data.get("country")} {market_name} Market.docx'
-        else:  # Global template
-            filename = f'Global {market_name} Market.docx'
+        filename = document_filename(data)
 
         # Store document data in MongoDB
         doc_id = store_document_data(
@@ -923,12 +1166,14 @@ def generate_word_doc():
             template_type=data.get("template_type", "Global")
         )
             
-        return send_file(
+        response = send_file(
             in_memory_file,
             mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
             download_name=filename,
             as_attachment=True
         )
+        response.headers.set('X-Output-Cache', 'hit' if cache_hit else 'miss')
+        return response
     
         # Add CORS headers to the send_file response
         origin = request.headers.get('Origin')
@@ -967,6 +1212,632 @@ def generate_word_doc():
     
     return response, 500
     
+# Tried in order; latin-1 decodes any byte sequence, so it comes last
+CSV_ENCODINGS = ('utf-8', 'cp1252', 'latin1')
+
+CSV_READ_ERROR_MESSAGE = "Unable to read CSV file. Please ensure it's properly encoded (UTF-8 or Windows-1252)."
+
+class BulkCsvError(ValueError):
+    """The upload stopped being readable as CSV after generation had started."""
+
+def _decode_csv_fallback(error):
+    """
+    Decoding error handler for bulk CSV uploads: bytes the detected encoding
+    cannot decode are read as Windows-1252, or Latin-1 for the few bytes
+    Windows-1252 leaves undefined. The encoding is detected from the start of
+    the upload only, so a Windows-1252 character further on must not fail
+    the job.
+    """
+    if not isinstance(error, UnicodeDecodeError):
+        raise error
+    text = []
+    for byte in error.object[error.start:error.end]:
+        try:
+            text.append(bytes([byte]).decode('cp1252'))
+        except UnicodeDecodeError:
+            text.append(bytes([byte]).decode('latin1'))
+    return ''.join(text), error.end
+
+codecs.register_error('bulk_csv_fallback', _decode_csv_fallback)
+
+def iter_csv_chunks(chunks):
+    """
+    Yield the remaining chunks of a bulk upload, turning read errors that
+    only surface once parsing has reached them into BulkCsvError.
+    """
+    try:
+        yield from chunks
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise BulkCsvError(str(e)) from e
+
+def detect_csv_encoding(stream, sample_size):
+    """
+    Detect the encoding of an uploaded CSV from its first bytes.
+    
+    A UTF-8 byte order mark selects utf-8-sig; otherwise the first encoding
+    that decodes the sample wins. A multi-byte character cut off at the end
+    of the sample is not an error. The stream is rewound afterwards.
+    
+    Args:
+        stream: Binary, seekable upload stream
+        sample_size (int): Number of leading bytes to inspect
+        
+    Returns:
+        str: The encoding name, or None if none of the candidates fits
+    """
+    stream.seek(0)
+    sample = stream.read(sample_size)
+    stream.seek(0)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    for encoding in CSV_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+# A validated bulk CSV row, ready for generation
+BulkRow = namedtuple('BulkRow', ['index', 'filename', 'doc_data', 'input_data', 'template_path', 'presence'])
+
+class BulkRecorder:
+    """
+    Buffers the MongoDB writes of a bulk job and flushes them in batches.
+    
+    Every row becomes a child record in the bulk_files collection, indexed on
+    bulk_id, so the bulk record itself stays a fixed-size header holding only
+    counters. Generated documents also get their usual documents record; its
+    id is allocated client side so the child record can reference it within
+    the same batch.
+    """
+
+    def __init__(self, db, bulk_id, user_id, batch_size):
+        self.documents = db.documents
+        self.bulk_files = db.bulk_files
+        self.bulk_id = bulk_id
+        self.user_id = user_id
+        self.batch_size = max(1, batch_size)
+        self.flushes = 0
+        self._inserts = []
+        self._files = []
+        self._successful = 0
+        self._failed = 0
+
+    def _file(self, row_index, filename, status, **fields):
+        return {
+            "bulk_id": self.bulk_id,
+            "user_id": self.user_id,
+            "row": row_index + 1,
+            "filename": filename,
+            "status": status,
+            "created_at": datetime.now(pytz.timezone('Asia/Kolkata')).isoformat(),  # IST timezone
+            **fields
+        }
+
+    def completed(self, row_index, doc_record):
+        """Buffer the record of a generated document and its bulk file entry."""
+        doc_record["_id"] = ObjectId()
+        self._inserts.append(InsertOne(doc_record))
+        self._files.append(self._file(row_index, doc_record["filename"], "completed", doc_id=doc_record["_id"]))
+        self._successful += 1
+        self._flush_if_full()
+
+    def failed(self, row_index, filename, error):
+        """Buffer the bulk file entry of a failed row."""
+        self._files.append(self._file(row_index, filename, "failed", error=str(error)))
+        self._failed += 1
+        self._flush_if_full()
+
+    def _flush_if_full(self):
+        if len(self._files) >= self.batch_size:
+            self.flush()
+
+    def flush(self, fields=None):
+        """
+        Write the buffered records, file entries and counter updates.
+        
+        Costs one round trip for the child records and one for the document
+        records together with the bulk header update, whatever the batch size.
+        Each buffer is cleared as soon as its own write succeeds, so flushing
+        again after a failure does not write the child records twice.
+        
+        Args:
+            fields (dict, optional): Extra fields to $set on the bulk record
+        """
+        if self._files:
+            self.bulk_files.insert_many(self._files, ordered=False)
+            self._files = []
+        update = {}
+        if self._successful or self._failed:
+            update["$inc"] = {
+                "total_files": self._successful + self._failed,
+                "successful_files": self._successful,
+                "failed_files": self._failed
+            }
+        if fields:
+            update["$set"] = fields
+        if not update:
+            return
+        self.documents.bulk_write(self._inserts + [UpdateOne({"_id": self.bulk_id}, update)], ordered=True)
+        self.flushes += 1
+        self._inserts = []
+        self._successful = self._failed = 0
+
+def record_bulk_failure(recorder, results, index, filename, error):
+    """Count a failed bulk row and record it on the bulk record."""
+    error_msg = f"Error in row {index + 1}: {str(error)}"
+    current_app.logger.error(error_msg)
+    results['failed'] += 1
+    results['errors'].append(error_msg)
+    recorder.failed(index, filename, error)
+
+TEMPLATE_TYPES = ('Global', 'Regional', 'Country')
+
+class BulkColumns:
+    """
+    Column layout of a bulk CSV - which segmentN, segmentN_subM and companyN
+    columns it has - resolved once per file.
+    """
+
+    def __init__(self, columns):
+        columns = set(columns)
+        self.has_region = 'region' in columns
+        self.has_country = 'country' in columns
+        # (segment number, column, [(sub-segment number, column), ...])
+        self.segments = [
+            (i, f'segment{i}', [(j, f'segment{i}_sub{j}') for j in range(1, 11) if f'segment{i}_sub{j}' in columns])
+            for i in range(1, 7)
+            if f'segment{i}' in columns
+        ]
+        self.companies = [(i, f'company{i}') for i in range(1, 11) if f'company{i}' in columns]
+
+    def value_columns(self):
+        for i, column, subs in self.segments:
+            yield column
+            for j, sub_column in subs:
+                yield sub_column
+        for i, column in self.companies:
+            yield column
+
+def _blank_mask(chunk, column, present):
+    # True where a required column is missing, empty or whitespace only
+    if not present:
+        return np.ones(len(chunk), dtype=bool)
+    values = chunk[column]
+    return (values.isna() | values.str.strip().eq('')).to_numpy()
+
+def _stripped_values(chunk, column, present):
+    # Stripped cell values of a column, with '' for blank cells or a missing column
+    if not present:
+        return [''] * len(chunk)
+    return chunk[column].str.strip().fillna('').tolist()
+
+def normalize_bulk_chunk(chunk, layout):
+    """
+    Convert a chunk of bulk CSV rows into generation payloads, column by column.
+    
+    Null masks and stripped values are computed once per column for the whole
+    chunk; rows are then assembled from plain lists. The segment presence
+    bitmap of every row (see segment_presence) falls out of the same masks.
+    
+    Args:
+        chunk: DataFrame of raw CSV rows (all values strings or NaN)
+        layout (BulkColumns): Column layout of the file
+        
+    Returns:
+        list: (row index, doc_data, presence, input_data, error) for every row;
+            doc_data is None and error is set for invalid rows
+    """
+    n = len(chunk)
+    masks, filled, values = {}, {}, {}
+    for column in layout.value_columns():
+        stripped = chunk[column].str.strip()
+        masks[column] = chunk[column].notna().to_numpy()
+        filled[column] = (stripped.notna() & stripped.ne('')).to_numpy()
+        values[column] = stripped.tolist()
+
+    # Presence bitmap, built with the same bit layout as segment_presence
+    presence = np.zeros(n, dtype=object)
+    for i, column, subs in layout.segments:
+        base = (i - 1) * 11
+        segment_mask = masks[column]
+        presence[segment_mask] += 1 << base
+        for j, sub_column in subs:
+            presence[segment_mask & masks[sub_column]] += 1 << (base + j)
+        presence[filled[column]] += 1 << (66 + i - 1)
+
+    template_types = chunk['template_type'].tolist()
+    valid_type = chunk['template_type'].isin(TEMPLATE_TYPES).to_numpy()
+    market_name_blank = _blank_mask(chunk, 'market_name', True)
+    region_blank = _blank_mask(chunk, 'region', layout.has_region)
+    country_blank = _blank_mask(chunk, 'country', layout.has_country)
+    market_names = _stripped_values(chunk, 'market_name', True)
+    regions = _stripped_values(chunk, 'region', layout.has_region)
+    countries = _stripped_values(chunk, 'country', layout.has_country)
+    records = chunk.to_dict('records')
+
+    rows = []
+    for r, index in enumerate(chunk.index.tolist()):
+        template_type = template_types[r]
+        if not valid_type[r]:
+            error = ValueError(f"Invalid template_type in row {index + 1}: {template_type}")
+        elif market_name_blank[r]:
+            error = ValueError(f"market_name is required in row {index + 1}")
+        elif template_type == 'Regional' and region_blank[r]:
+            error = ValueError(f"Region is required for Regional template in row {index + 1}")
+        elif template_type == 'Country' and country_blank[r]:
+            error = ValueError(f"Country is required for Country template in row {index + 1}")
+        else:
+            error = None
+        if error is not None:
+            rows.append((index, None, None, records[r], error))
+            continue
+
+        # Prepare data for document generation
+        doc_data = {
+            "template_type": template_type,
+            "market_name": market_names[r],
+            "region": regions[r],
+            "country": countries[r]
+        }
+        for i, column, subs in layout.segments:
+            if masks[column][r]:
+                doc_data[f'Segment{i}'] = values[column][r]
+                for j, sub_column in subs:
+                    if masks[sub_column][r]:
+                        doc_data[f'Segment{i}Sub-segment{j}'] = values[sub_column][r]
+        for i, column in layout.companies:
+            if masks[column][r]:
+                doc_data[f'Company{i}'] = values[column][r]
+
+        rows.append((index, doc_data, presence[r], records[r], None))
+    return rows
+
+def bulk_filename(doc_data):
+    """Create the ZIP entry name of a bulk document."""
+    if doc_data['template_type'] == 'Regional':
+        filename = f"{doc_data['region']}_{doc_data['market_name']}_Market.docx"
+    elif doc_data['template_type'] == 'Country':
+        filename = f"{doc_data['country']}_{doc_data['market_name']}_Market.docx"
+    else:
+        filename = f"{doc_data['market_name']}_Global_Market.docx"
+
+    # Clean filename
+    return "".join(c for c in filename if c.isalnum() or c in (' ', '_', '-', '.'))
+
+def iter_bulk_rows(chunks, on_error):
+    """
+    Validate and normalise bulk CSV rows as their chunks are parsed.
+    
+    The column layout is resolved from the first chunk. Within a chunk, valid
+    rows are yielded grouped by template and segment presence bitmap, so rows
+    sharing a structure reuse the same cached skeleton back to back.
+    
+    Args:
+        chunks: DataFrame chunks of the upload, in order
+        on_error (callable): Called with (row index, filename, exception) for an invalid row
+        
+    Yields:
+        BulkRow: Each valid row, ready for generation
+    """
+    layout = None
+    template_paths = {}
+    for chunk in chunks:
+        if layout is None:
+            layout = BulkColumns(chunk.columns)
+
+        ready = []
+        for index, doc_data, presence, input_data, error in normalize_bulk_chunk(chunk, layout):
+            if error is not None:
+                on_error(index, "undefined_file.docx", error)
+                continue
+
+            filename = bulk_filename(doc_data)
+            try:
+                key = (doc_data['template_type'], doc_data['region'] if doc_data['template_type'] == 'Regional' else None)
+                if key not in template_paths:
+                    template_paths[key] = get_template_path(key[0], region=key[1])
+            except Exception as e:
+                on_error(index, filename, e)
+                continue
+            ready.append(BulkRow(index, filename, doc_data, input_data, template_paths[key], presence))
+
+        shapes = {(row.template_path, row.presence) for row in ready}
+        current_app.logger.info(f"Normalised {len(chunk)} CSV rows: {len(ready)} valid, {len(shapes)} document structures")
+        ready.sort(key=lambda row: (row.template_path, row.presence))
+        yield from ready
+
+# Application context of a bulk pool process, pushed for its lifetime
+_bulk_worker_context = None
+
+def _init_bulk_worker(config, root_path, log_level, template_paths):
+    """
+    Set up a bulk generation worker process: an application context for the
+    generation code and its own compiled copy of every template the job uses.
+    """
+    global _bulk_worker_context
+    app = Flask(__name__, root_path=root_path)
+    app.config.update(config)
+    logger = logging.getLogger('app')
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+    logger.setLevel(log_level)
+    app.logger = logger
+    _bulk_worker_context = app.app_context()
+    _bulk_worker_context.push()
+    for template_path in template_paths:
+        template_cache.get(template_path)
+
+def _generate_bulk_document(doc_data, presence=None):
+    # Errors are returned as text: arbitrary exceptions do not always survive pickling
+    try:
+        return generate_single_document(doc_data, None, presence).getvalue(), None
+    except Exception as e:
+        return None, str(e)
+
+def _start_bulk_pool(workers, template_paths):
+    try:
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            # Spawned, not forked: the web worker runs driver and executor threads
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_bulk_worker,
+            initargs=(dict(current_app.config), current_app.root_path,
+                      current_app.logger.getEffectiveLevel(), template_paths)
+        )
+    except (OSError, NotImplementedError) as e:
+        current_app.logger.warning(f"Bulk process pool unavailable, generating in process: {str(e)}")
+        return None
+    current_app.logger.info(f"Started bulk process pool of {workers} workers")
+    return pool
+
+_bulk_pool = ProcessLocal(_start_bulk_pool)
+_bulk_pool_lock = threading.Lock()
+_bulk_pool_jobs = 0
+_bulk_pool_idle_timer = None
+
+def get_bulk_pool(workers, template_paths):
+    """
+    Return this web worker's bulk generation process pool, creating it on first use.
+
+    The pool outlives the request, so its processes keep their compiled
+    templates and skeletons from one bulk job to the next, until it has been
+    idle for BULK_POOL_IDLE_SECONDS. Every successful call must be paired with
+    release_bulk_pool once the job is done with the pool.
+
+    Returns:
+        ProcessPoolExecutor: The pool, or None if it cannot be created here
+            (e.g. no /dev/shm for its semaphores, as on AWS Lambda)
+    """
+    global _bulk_pool_jobs, _bulk_pool_idle_timer
+    with _bulk_pool_lock:
+        pool = _bulk_pool.get(workers, template_paths)
+        if pool is not None:
+            _bulk_pool_jobs += 1
+            if _bulk_pool_idle_timer is not None:
+                _bulk_pool_idle_timer.cancel()
+                _bulk_pool_idle_timer = None
+        return pool
+
+def release_bulk_pool(pool, idle_seconds):
+    """
+    Mark a bulk job done with the pool; once no job uses it, shut it down
+    after idle_seconds, or never if idle_seconds is 0.
+    """
+    global _bulk_pool_jobs, _bulk_pool_idle_timer
+    with _bulk_pool_lock:
+        _bulk_pool_jobs -= 1
+        if _bulk_pool_jobs == 0 and idle_seconds > 0:
+            _bulk_pool_idle_timer = threading.Timer(idle_seconds, _shut_down_idle_bulk_pool, args=(pool,))
+            _bulk_pool_idle_timer.daemon = True
+            _bulk_pool_idle_timer.start()
+
+def _shut_down_idle_bulk_pool(pool):
+    global _bulk_pool_idle_timer
+    with _bulk_pool_lock:
+        # Not if a job took the pool, or a newer timer replaced this one, meanwhile
+        if _bulk_pool_jobs or _bulk_pool_idle_timer is not threading.current_thread():
+            return
+        _bulk_pool_idle_timer = None
+        _bulk_pool.discard(pool)
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def discard_bulk_pool(pool):
+    """Drop a broken pool so the next bulk job starts a fresh one."""
+    _bulk_pool.discard(pool)
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def iter_bulk_documents(rows):
+    """
+    Generate the documents of validated bulk rows in parallel, as rows arrive.
+    
+    Rows are fanned out to this web worker's pool of BULK_WORKERS processes
+    (see get_bulk_pool). At most two rows per process are in flight, so rows
+    are pulled from the CSV stream only as fast as documents finish. Jobs with
+    a single row, BULK_WORKERS=0, serverless deployments and hosts where the
+    pool cannot start generate in this process instead. When a pool process
+    dies, the rows in flight on the pool and the rows still to come are
+    generated in this process too.
+    
+    Args:
+        rows (iterable): BulkRow tuples
+        
+    Yields:
+        tuple: (row, document bytes or None, error message or None), in completion order
+    """
+    rows = iter(rows)
+    workers = current_app.config.get('BULK_WORKERS', 2)
+    window = max(workers, 1) * 2
+    head = list(itertools.islice(rows, window))
+    rows = itertools.chain(head, rows)
+
+    pool = None
+    if workers >= 1 and len(head) > 1 and not current_app.config.get('SERVERLESS'):
+        pool = get_bulk_pool(workers, sorted({row.template_path for row in head}))
+
+    if pool is not None:
+        idle_seconds = current_app.config.get('BULK_POOL_IDLE_SECONDS', 300)
+        in_flight = {}
+        retry = []  # rows the pool broke on, generated in process below
+
+        def finished():
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                row = in_flight.pop(future)
+                try:
+                    blob, error = future.result()
+                except BrokenProcessPool:  # a worker process died
+                    retry.append(row)
+                    continue
+                except Exception as e:
+                    blob, error = None, str(e)
+                yield row, blob, error
+
+        try:
+            for row in rows:
+                while len(in_flight) >= window and not retry:
+                    yield from finished()
+                if retry:
+                    retry.append(row)
+                    break
+                try:
+                    in_flight[pool.submit(_generate_bulk_document, row.doc_data, row.presence)] = row
+                except (BrokenProcessPool, RuntimeError):
+                    retry.append(row)
+                    break
+            while in_flight:
+                yield from finished()
+        finally:
+            # Abandoned mid-job (e.g. the client went away): don't leave rows queued on the shared pool
+            for future in in_flight:
+                future.cancel()
+            release_bulk_pool(pool, idle_seconds)
+        if retry:
+            current_app.logger.error("Bulk process pool broke, generating the remaining rows in process")
+            discard_bulk_pool(pool)
+        rows = itertools.chain(retry, rows)
+
+    for row in rows:
+        yield (row, *_generate_bulk_document(row.doc_data, row.presence))
+
+def iter_bulk_results(rows, user, bulk_id, recorder, results):
+    """
+    Generate bulk rows and record every outcome.
+    
+    Yields:
+        tuple: (filename, document bytes) for each generated document, in the
+            order they finish
+    """
+    for bulk_row, blob, error in iter_bulk_documents(rows):
+        if error is not None:
+            record_bulk_failure(recorder, results, bulk_row.index, bulk_row.filename, error)
+            continue
+
+        # Store individual document data
+        doc_record = {
+            "user_id": ObjectId(user['_id']),
+            "bulk_id": bulk_id,
+            "input_data": bulk_row.input_data,
+            "filename": bulk_row.filename,
+            "template_type": bulk_row.doc_data['template_type'],
+            "generation_type": "bulk",
+            "created_at": datetime.now(pytz.timezone('Asia/Kolkata')).isoformat(),  # IST timezone
+            "status": "completed"
+        }
+        recorder.completed(bulk_row.index, doc_record)
+        results['success'] += 1
+        yield bulk_row.filename, blob
+
+class ZipStreamSink:
+    """
+    Write-only, unseekable file object collecting ZipFile output between
+    reads. zipfile then writes each entry as local header, data and data
+    descriptor, and the central directory when closed.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Return and forget everything written since the last drain."""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_bulk_zip(documents, user, bulk_id, recorder, results, upload):
+    """
+    Stream a bulk job's ZIP archive while it is being generated.
+    
+    Each entry is sent as soon as its document finishes, so bytes start
+    flowing with the first document and keep flowing for the whole job; the
+    central directory follows the last one. Failed rows cannot change the
+    status code once streaming has started, so they are listed in an
+    errors.txt entry instead. If the client goes away first, generation
+    stops and the bulk record is marked failed with the rows recorded so far.
+    
+    Args:
+        upload: The CSV upload the rows are read from; closed when streaming ends
+    
+    Returns:
+        Response: Chunked application/zip response
+    """
+    def generate():
+        sink = ZipStreamSink()
+        final = {"status": "failed", "error": "Streaming stopped before the archive was complete"}
+        flushed = False
+        try:
+            with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as zf:
+                try:
+                    for filename, blob in documents:
+                        zf.writestr(filename, blob)
+                        yield sink.drain()
+                    final = {"status": "completed"}
+                except BulkCsvError as e:
+                    # The rest of the upload is unreadable: close the archive with what was generated
+                    current_app.logger.error(f"Error reading CSV of bulk job {bulk_id}: {str(e)}")
+                    results['errors'].append(f"{CSV_READ_ERROR_MESSAGE} ({str(e)})")
+                    final = {"status": "failed", "error": str(e)}
+                if results['errors']:
+                    zf.writestr('errors.txt', '\n'.join(results['errors']) + '\n')
+                recorder.flush(final)
+                flushed = True
+            yield sink.drain()
+            current_app.logger.info(
+                f"Streamed bulk generation completed for user: {user['username']}. "
+                f"Success: {results['success']}, Failed: {results['failed']}"
+            )
+        except GeneratorExit:
+            current_app.logger.warning(f"Client disconnected from streamed bulk job {bulk_id}")
+            final = {"status": "failed", "error": "Client disconnected before the archive was complete"}
+            raise
+        except Exception as e:
+            # Too late for an error response: abort, leaving the client a truncated archive
+            current_app.logger.error(f"Error in streamed bulk generation {bulk_id}: {traceback.format_exc()}")
+            final = {"status": "failed", "error": str(e)}
+            raise
+        finally:
+            # Stop generating, and record the rows done so far unless the final flush already ran
+            documents.close()
+            upload.close()
+            if not flushed:
+                recorder.flush(final)
+
+    response = Response(stream_with_context(generate()), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename='generated_documents.zip')
+    # Ask nginx not to buffer, so entries reach the client as they are written
+    response.headers.set('X-Accel-Buffering', 'no')
+    return response
+
 @bp.route('/generate-bulk', methods=['POST'])
 def generate_bulk_documents():
     """Generate multiple Word documents from CSV data."""
@@ -1001,197 +1872,99 @@ def generate_bulk_documents():
         if file.filename == '':
             return jsonify({"message": "No file selected"}), 400
 
-        # Try different encodings
-        encodings_to_try = ['utf-8', 'utf-8-sig', 'latin1', 'cp1252']
-        csv_data = None
-        successful_encoding = None
+        # Opt-in streaming: ZIP entries are sent as documents finish
+        streaming = request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+        upload = file.stream
+        if streaming:
+            # Flask closes the request's files when the view returns, but a
+            # streamed job keeps reading chunks afterwards: read from a copy
+            upload = tempfile.SpooledTemporaryFile(
+                max_size=current_app.config.get('BULK_UPLOAD_SPOOL_BYTES', 8 * 1024 * 1024)
+            )
+            shutil.copyfileobj(file.stream, upload)
+            upload.seek(0)
 
-        for encoding in encodings_to_try:
-            try:
-                # Reset file pointer
-                file.stream.seek(0)
-                # Try to read with current encoding
-                stream = StringIO(file.stream.read().decode(encoding))
-                csv_data = pd.read_csv(stream)
-                successful_encoding = encoding
-                break
-            except UnicodeDecodeError:
-                continue
-            except Exception as e:
-                current_app.logger.error(f"Error reading CSV with {encoding} encoding: {str(e)}")
-                continue
+        # Detect the encoding once, from the start of the upload
+        encoding = detect_csv_encoding(upload, current_app.config.get('BULK_CSV_SAMPLE_BYTES', 64 * 1024))
+        if encoding is None:
+            return jsonify({"message": CSV_READ_ERROR_MESSAGE}), 400
 
-        if csv_data is None:
-            return jsonify({
-                "message": "Unable to read CSV file. Please ensure it's properly encoded (UTF-8 or Windows-1252)."
-            }), 400
+        # Parse the upload as a stream of row chunks, decoded on the fly
+        try:
+            chunks = pd.read_csv(
+                codecs.getreader(encoding)(upload, errors='bulk_csv_fallback'),
+                dtype=str,
+                chunksize=current_app.config.get('BULK_CSV_CHUNK_ROWS', 500)
+            )
+            first_chunk = next(chunks)
+        except (StopIteration, pd.errors.EmptyDataError, pd.errors.ParserError, UnicodeDecodeError) as e:
+            current_app.logger.error(f"Error reading CSV with {encoding} encoding: {str(e)}")
+            return jsonify({"message": CSV_READ_ERROR_MESSAGE}), 400
 
-        current_app.logger.info(f"Successfully read CSV with {successful_encoding} encoding")
+        current_app.logger.info(f"Reading CSV with {encoding} encoding")
 
         # Validate required columns
         required_columns = ['template_type', 'market_name']
-        missing_columns = [col for col in required_columns if col not in csv_data.columns]
+        missing_columns = [col for col in required_columns if col not in first_chunk.columns]
         if missing_columns:
             return jsonify({
                 "message": f"Missing required columns: {', '.join(missing_columns)}"
             }), 400
 
-        # Create a ZIP file in memory
-        memory_zip = BytesIO()
-        with zipfile.ZipFile(memory_zip, 'w') as zf:
-            # Track processing results
-            results = {
-                'success': 0,
-                'failed': 0,
-                'errors': []
-            }
-           
-            # Create a bulk operation record
-            bulk_record = {
-                "user_id": ObjectId(user['_id']),
-                "type": "bulk",
-                "status": "processing",
-                "created_at": datetime.now(pytz.timezone('Asia/Kolkata')).isoformat(),  # IST timezone
-                "total_files": 0,
-                "successful_files": 0,
-                "failed_files": 0,
-                "files": []
-            }
-        
-            bulk_id = db.documents.insert_one(bulk_record).inserted_id    
+        # Track processing results
+        results = {
+            'success': 0,
+            'failed': 0,
+            'errors': []
+        }
+       
+        # Create a bulk operation record
+        bulk_record = {
+            "user_id": ObjectId(user['_id']),
+            "type": "bulk",
+            "status": "processing",
+            "created_at": datetime.now(pytz.timezone('Asia/Kolkata')).isoformat(),  # IST timezone
+            "total_files": 0,
+            "successful_files": 0,
+            "failed_files": 0
+        }
+    
+        bulk_id = db.documents.insert_one(bulk_record).inserted_id
+        recorder = BulkRecorder(db, bulk_id, bulk_record["user_id"], current_app.config.get('BULK_WRITE_BATCH_SIZE', 50))
 
-            # Process each row in the CSV
-            for index, row in csv_data.iterrows():
-                try:
-                    # Define filename early to use in error handling
-                    filename = "undefined_file.docx"  # Default filename
-                    
-                    # Validate template type
-                    if row['template_type'] not in ['Global', 'Regional', 'Country']:
-                        raise ValueError(f"Invalid template_type in row {index + 1}: {row['template_type']}")
-
-                    # Validate region for Regional template
-                    if row['template_type'] == 'Regional' and (pd.isna(row.get('region')) or row['region'].strip() == ''):
-                        raise ValueError(f"Region is required for Regional template in row {index + 1}")
-
-                    # Validate country for Country template
-                    if row['template_type'] == 'Country' and (pd.isna(row.get('country')) or row['country'].strip() == ''):
-                        raise ValueError(f"Country is required for Country template in row {index + 1}")
-
-                    # Prepare data for document generation
-                    doc_data = {
-                        "template_type": row['template_type'],
-                        "market_name": row['market_name'],
-                        "region": row.get('region', ''),
-                        "country": row.get('country', '')
-                    }
-                    
-                    # Add segments and sub-segments
-                    for i in range(1, 7):
-                        segment_key = f'segment{i}'
-                        if segment_key in row and pd.notna(row[segment_key]):
-                            doc_data[f'Segment{i}'] = str(row[segment_key]).strip()
-                            # Add sub-segments if they exist
-                            for j in range(1, 11):
-                                sub_key = f'segment{i}_sub{j}'
-                                if sub_key in row and pd.notna(row[sub_key]):
-                                    doc_data[f'Segment{i}Sub-segment{j}'] = str(row[sub_key]).strip()
-
-                    # Add companies
-                    for i in range(1, 11):
-                        company_key = f'company{i}'
-                        if company_key in row and pd.notna(row[company_key]):
-                            doc_data[f'Company{i}'] = str(row[company_key]).strip()
-
-                    # Create filename BEFORE database operations
-                    if doc_data['template_type'] == 'Regional':
-                        filename = f"{doc_data['region']}_{doc_data['market_name']}_Market.docx"
-                    elif doc_data['template_type'] == 'Country':
-                        filename = f"{doc_data['country']}_{doc_data['market_name']}_Market.docx"
-                    else:
-                        filename = f"{doc_data['market_name']}_Global_Market.docx"
-
-                    # Clean filename
-                    filename = "".join(c for c in filename if c.isalnum() or c in (' ', '_', '-', '.'))
-                    
-                    # Store individual document data
-                    doc_record = {
-                        "user_id": ObjectId(user['_id']),
-                        "bulk_id": bulk_id,
-                        "input_data": row.to_dict(),
-                        "filename": filename,
-                        "template_type": row['template_type'],
-                        "generation_type": "bulk",
-                        "created_at": datetime.now(pytz.timezone('Asia/Kolkata')).isoformat(),  # IST timezone
-                        "status": "completed"
-                    }
-                
-                    doc_id = db.documents.insert_one(doc_record).inserted_id
-                    
-                    # Generate document
-                    doc = generate_single_document(doc_data, user)
-                    
-                    # Add to ZIP
-                    zf.writestr(filename, doc.getvalue())
-                    results['success'] += 1
-                    
-                    # Update bulk record for successful file
-                    db.documents.update_one(
-                        {"_id": bulk_id},
-                        {
-                            "$inc": {
-                                "total_files": 1,
-                                "successful_files": 1
-                            },
-                            "$push": {
-                                "files": {
-                                    "doc_id": doc_id,
-                                    "filename": filename,
-                                    "status": "completed"
-                                }
-                            }
-                        }
-                    )
+        def on_invalid_row(index, filename, error):
+            record_bulk_failure(recorder, results, index, filename, error)
 
-                except Exception as e:
-                    error_msg = f"Error in row {index + 1}: {str(e)}"
-                    current_app.logger.error(error_msg)
-                    results['failed'] += 1
-                    results['errors'].append(error_msg)
-                    
-                    # Update bulk record for failed file
-                    db.documents.update_one(
-                        {"_id": bulk_id},
-                        {
-                            "$inc": {
-                                "total_files": 1,
-                                "failed_files": 1
-                            },
-                            "$push": {
-                                "files": {
-                                    "filename": filename,  # Now safely defined
-                                    "status": "failed",
-                                    "error": str(e)
-                                }
-                            }
-                        }
-                    )
-
-            # Update final status of bulk operation
-            db.documents.update_one(
-                {"_id": bulk_id},
-                {"$set": {"status": "completed"}}
-            )
+        rows = iter_bulk_rows(itertools.chain([first_chunk], iter_csv_chunks(chunks)), on_invalid_row)
+        documents = iter_bulk_results(rows, user, bulk_id, recorder, results)
 
-            # If all documents failed, return error
-            if results['failed'] > 0 and results['success'] == 0:
-                return jsonify({
-                    "message": "Failed to generate any documents",
-                    "errors": results['errors']
-                }), 500
+        if streaming:
+            return stream_bulk_zip(documents, user, bulk_id, recorder, results, upload)
 
-        # Prepare ZIP file for download
-        memory_zip.seek(0)
+        # Spool the ZIP to disk once it outgrows BULK_ZIP_SPOOL_BYTES. Entries are
+        # stored, not deflated: .docx files are already compressed archives.
+        output_zip = tempfile.SpooledTemporaryFile(
+            max_size=current_app.config.get('BULK_ZIP_SPOOL_BYTES', 8 * 1024 * 1024)
+        )
+        with zipfile.ZipFile(output_zip, 'w', compression=zipfile.ZIP_STORED) as zf:
+            # Documents are added to the ZIP in the order they finish
+            for filename, blob in documents:
+                zf.writestr(filename, blob)
+
+            # Flush the last batch together with the final status of the bulk operation
+            recorder.flush({"status": "completed"})
+            current_app.logger.info(f"Bulk job {bulk_id} recorded in {recorder.flushes} batched writes")
+
+        # If all documents failed, return error; the archive is complete, so the spool can go
+        if results['failed'] > 0 and results['success'] == 0:
+            output_zip.close()
+            return jsonify({
+                "message": "Failed to generate any documents",
+                "errors": results['errors']
+            }), 500
+
+        # Prepare ZIP file for download; it is closed (and deleted) once sent
+        output_zip.seek(0)
         
         # Log completion
         current_app.logger.info(
@@ -1200,15 +1973,26 @@ def generate_bulk_documents():
         )
         
         return send_file(
-            memory_zip,
+            output_zip,
             mimetype='application/zip',
             as_attachment=True,
             download_name='generated_documents.zip'
         )
 
+    except BulkCsvError as e:
+        # A later chunk could not be parsed: same answer as an unreadable upload
+        current_app.logger.error(f"Error reading CSV of bulk job {bulk_id}: {str(e)}")
+        output_zip.close()
+        recorder.flush({"status": "failed", "error": str(e)})
+        return jsonify({"message": CSV_READ_ERROR_MESSAGE, "error": str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Error in bulk generation: {str(e)}")
-        if 'bulk_id' in locals():
+        if 'output_zip' in locals():
+            output_zip.close()
+        if 'recorder' in locals():
+            # Keep the rows recorded so far along with the failure
+            recorder.flush({"status": "failed", "error": str(e)})
+        elif 'bulk_id' in locals():
             db.documents.update_one(
                 {"_id": bulk_id},
                 {"$set": {"status": "failed", "error": str(e)}}
@@ -1218,7 +2002,63 @@ def generate_bulk_documents():
             "error": str(e)
         }), 500
 
-def generate_single_document(data, user):
+@bp.route('/bulk/<bulk_id>/files', methods=['GET'])
+def get_bulk_files(bulk_id):
+    """
+    List the files of a bulk job, one page at a time, in CSV row order.
+    
+    Query parameters:
+        page (int): 1-based page number (default 1)
+        page_size (int): Files per page (default 50, at most 500)
+        status (str, optional): Only files with this status (completed or failed)
+    """
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({"message": "Token is required"}), 401
+
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({"message": "Invalid token"}), 401
+
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        page_size = min(500, max(1, int(request.args.get('page_size', 50))))
+    except ValueError:
+        return jsonify({"message": "page and page_size must be integers"}), 400
+
+    db, client = get_db()
+    record, error = _find_job(db, bulk_id, user)
+    if error:
+        return error
+    if record.get("type") != "bulk":
+        return jsonify({"message": "Bulk job not found"}), 404
+
+    query = {"bulk_id": record["_id"]}
+    if request.args.get('status'):
+        query["status"] = request.args['status']
+
+    total = db.bulk_files.count_documents(query)
+    cursor = db.bulk_files.find(query, {"_id": 0, "bulk_id": 0, "user_id": 0}) \
+        .sort("row", 1).skip((page - 1) * page_size).limit(page_size)
+    files = []
+    for entry in cursor:
+        if "doc_id" in entry:
+            entry["doc_id"] = str(entry["doc_id"])
+        files.append(entry)
+
+    return jsonify({
+        "bulk_id": bulk_id,
+        "status": record.get("status"),
+        "total_files": record.get("total_files", 0),
+        "successful_files": record.get("successful_files", 0),
+        "failed_files": record.get("failed_files", 0),
+        "page": page,
+        "page_size": page_size,
+        "total": total,
+        "files": files
+    }), 200
+
+def generate_single_document(data, user, presence=None):
     """Generate a single document and return it as BytesIO object."""
     try:
         template_path = get_template_path(
@@ -1226,62 +2066,15 @@ def generate_single_document(data, user):
             region=data.get("region") if data["template_type"] == "Regional" else None
         )
         
-        doc = Document(template_path)
-        
-        # Extract all placeholder values upfront
-        region = data.get("region")
-        country = data.get("country")
-        market_name = data.get("market_name", "")
-        
-        # Process region/country specific content
         if data["template_type"] == "Regional":
-            region = validate_region(region)
-            replace_region(doc, region)
-            # Handle textbox replacements using dictionary format
-            replace_header_textbox(doc, {"region": region})
-            
-           
-                
-        elif data["template_type"] == "Country":
-            replace_country(doc, country)
-            # Handle textbox replacements using dictionary format
-            replace_header_textbox(doc, {"country": country})
-            
-            
-        # Replace market name
-        if market_name:
-            replace_text(doc, "{{market_name}}", market_name)
-            # Use dictionary form for consistency
-            replace_header_textbox(doc, {"market_name": market_name})
-            replace_textbox_text(doc, "{{market_name}}", market_name)
-
-        # Process segments and companies
-        segmentations = []
-        for i in range(1, 7):
-            if f'Segment{i}' in data:
-                sub_segments = []
-                for j in range(1, 11):
-                    sub_key = f'Segment{i}Sub-segment{j}'
-                    if sub_key in data:
-                        sub_segments.append(data[sub_key])
-                segmentations.append({
-                    "name": data[f'Segment{i}'],
-                    "subSegments": sub_segments
-                })
-
-        replace_segments(doc, segmentations)
-        clean_empty_segments(doc, segmentations)
-        
-        companies = [data.get(f"Company{i}", "") for i in range(1, 11)]
-        replace_companies(doc, companies)
+            validate_region(data.get("region"))
 
-        remove_unused_sections(doc, segmentations)
-        clean_all_segment_markers(doc)
-        update_document_references(doc)
+        instance = load_document(template_path, data, presence)
+        populate_document(instance, data)
 
         # Save to BytesIO
         output = BytesIO()
-        doc.save(output)
+        instance.doc.save(output)
         output.seek(0)
         return output
 
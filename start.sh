@@ -1,2 +1,4 @@
 #!/bin/bash
-gunicorn -w 4 -b 0.0.0.0:5000 app:app
\ No newline at end of file
+set -e
+flask --app app migrate
+gunicorn -w 4 --worker-class gthread --threads 32 -b 0.0.0.0:5000 app:app
@@ -1,9 +1,175 @@
+import threading
+import time
+from collections import OrderedDict
 from flask import current_app
 from datetime import datetime, timedelta
-from bcrypt import checkpw
-from pymongo import MongoClient
 from bson.objectid import ObjectId
 from jose import jwt as jose_jwt
+from utils.db import get_database
+from utils.passwords import verify_password
+from utils.process_local import ProcessLocal
+
+class UserCache:
+    """
+    Per-process cache of user documents looked up by get_user_from_token.
+
+    Entries expire after USER_CACHE_TTL_SECONDS and the least recently used
+    are evicted beyond USER_CACHE_SIZE. Routes that change a user invalidate
+    it here at once; other worker processes see the change when their entry
+    expires.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = OrderedDict()  # user_id -> (expires_at, user)
+        self.hits = 0
+        self.misses = 0
+
+    def _config(self):
+        config = current_app.config
+        return config.get('USER_CACHE_TTL_SECONDS', 30), config.get('USER_CACHE_SIZE', 1024)
+
+    def get(self, user_id):
+        """
+        Look up a cached user.
+
+        Returns:
+            dict: A copy of the user document, or None if missing or expired
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return dict(entry[1])
+            if entry is not None:
+                del self._users[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user_id, user):
+        ttl, maxsize = self._config()
+        if ttl <= 0 or maxsize <= 0:
+            return
+        with self._lock:
+            self._users[user_id] = (time.monotonic() + ttl, dict(user))
+            self._users.move_to_end(user_id)
+            while len(self._users) > maxsize:
+                self._users.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Forget a user whose document has changed."""
+        with self._lock:
+            self._users.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def stats(self):
+        ttl, maxsize = self._config()
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'maxsize': maxsize,
+                'ttl_seconds': ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+user_cache = UserCache()
+
+class RevocationSet:
+    """
+    Ids of restricted users, kept per worker process for stateless token checks.
+
+    A daemon thread, started in each process on first use, reloads the set
+    from MongoDB every REVOCATION_SYNC_SECONDS. Until the first sync, or if
+    syncing has stalled for three intervals, the set is not ready and callers
+    should fall back to looking the user up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = frozenset()
+        self._synced_at = None
+        self._thread = ProcessLocal(self._start)
+        self.syncs = 0
+        self.sync_failures = 0
+
+    def _interval(self):
+        return current_app.config.get('REVOCATION_SYNC_SECONDS', 15)
+
+    def ensure_started(self, app):
+        """Start this process's sync thread if it is not running yet."""
+        self._thread.get(app)
+
+    def _start(self, app):
+        with self._lock:
+            # A set inherited across fork has no thread keeping it fresh
+            self._synced_at = None
+        thread = threading.Thread(target=self._run, args=(app,), name='revocation-sync', daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self, app):
+        with app.app_context():
+            while True:
+                self.sync()
+                time.sleep(self._interval())
+
+    def sync(self):
+        """
+        Reload the restricted user ids from MongoDB.
+
+        Returns:
+            bool: True if the set was reloaded
+        """
+        try:
+            cursor = get_database().users.find({'status': 'restricted'}, {'_id': 1})
+            revoked = frozenset(str(user['_id']) for user in cursor)
+        except Exception as e:
+            with self._lock:
+                self.sync_failures += 1
+            current_app.logger.warning(f"Could not sync revoked users: {str(e)}")
+            return False
+        with self._lock:
+            self._revoked = revoked
+            self._synced_at = time.monotonic()
+            self.syncs += 1
+        return True
+
+    def ready(self):
+        synced_at = self._synced_at
+        return synced_at is not None and time.monotonic() - synced_at <= 3 * self._interval()
+
+    def is_revoked(self, user_id):
+        return str(user_id) in self._revoked
+
+    def update(self, user_id, status):
+        """Apply a status change made by this process before the next sync."""
+        with self._lock:
+            if status == 'restricted':
+                self._revoked = self._revoked | {str(user_id)}
+            else:
+                self._revoked = self._revoked - {str(user_id)}
+
+    def stats(self):
+        synced_at = self._synced_at
+        with self._lock:
+            return {
+                'revoked': len(self._revoked),
+                'ready': self.ready(),
+                'seconds_since_sync': None if synced_at is None else round(time.monotonic() - synced_at, 1),
+                'syncs': self.syncs,
+                'sync_failures': self.sync_failures
+            }
+
+revoked_users = RevocationSet()
+
+# Claims a token must carry to be authorized without a database lookup
+STATELESS_CLAIMS = ('user_id', 'username', 'role', 'status')
 
 def create_token(payload):
     """Generates a JWT token with a 3-hour expiration time."""
@@ -13,10 +179,33 @@ def create_token(payload):
 
 def authenticate_user(password, hashed_password):
     """Authenticates a user's password against a stored hashed password."""
-    return checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return verify_password(password, hashed_password)
+
+def user_from_claims(payload):
+    """
+    Build the authorized user from verified token claims alone.
+
+    Returns:
+        dict: The user, or None if the token lacks the claims
+    """
+    if not all(payload.get(claim) for claim in STATELESS_CLAIMS):
+        return None
+    return {
+        '_id': ObjectId(payload['user_id']),
+        'username': payload['username'],
+        'role': payload['role'],
+        'status': payload['status']
+    }
 
 def get_user_from_token(token):
-    """Retrieves user data from a JWT token."""
+    """
+    Retrieves user data from a JWT token.
+
+    With AUTH_STATELESS_TOKENS the user is taken from the token's claims,
+    and tokens of users in the revocation set are rejected; otherwise, and
+    for tokens without those claims, the user is looked up (through the user
+    cache) and rejected if restricted.
+    """
     try:
         # Strip 'Bearer ' prefix if present
         if token.startswith('Bearer '):
@@ -26,20 +215,36 @@ def get_user_from_token(token):
         payload = jose_jwt.decode(token, secret_key, algorithms=['HS256'])
         user_id = payload.get("user_id")
         
-        # Get database connection from current app
-        db = current_app.db
-        users_collection = db.users
-        
-        # Log the user ID we're looking up
-        current_app.logger.info(f"Looking up user with ID: {user_id}")
+        if current_app.config.get('AUTH_STATELESS_TOKENS'):
+            user = user_from_claims(payload)
+            revoked_users.ensure_started(current_app._get_current_object())
+            # Without a fresh revocation set, fall back to the lookup below
+            if user and revoked_users.ready():
+                if revoked_users.is_revoked(user_id):
+                    current_app.logger.warning(f"Rejected token of revoked user {user_id}")
+                    return None
+                return user
         
-        user = users_collection.find_one({"_id": ObjectId(user_id)})
-        
-        if user:
+        user = user_cache.get(user_id)
+        if not user:
+            # Get database connection from the shared client
+            db = get_database()
+            users_collection = db.users
+            
+            # Log the user ID we're looking up
+            current_app.logger.info(f"Looking up user with ID: {user_id}")
+            
+            user = users_collection.find_one({"_id": ObjectId(user_id)})
+            if not user:
+                current_app.logger.warning(f"No user found with ID: {user_id}")
+                return None
             current_app.logger.info(f"Found user: {user.get('username', 'unknown')}")
-            return user
-        else:
-            current_app.logger.warning(f"No user found with ID: {user_id}")
+            user_cache.put(user_id, user)
+        
+        if user.get('status') == 'restricted':
+            current_app.logger.warning(f"Rejected token of restricted user {user_id}")
+            return None
+        return user
             
     except jose_jwt.ExpiredSignatureError:
         current_app.logger.error("Token has expired")
@@ -0,0 +1,115 @@
+import os
+import threading
+from flask import current_app
+from pymongo import MongoClient
+from pymongo import monitoring
+from utils.process_local import ProcessLocal
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters of one MongoClient, fed by pymongo's CMAP events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checked_in = 0
+        self.checkout_failures = 0
+        self.pools_cleared = 0
+
+    def _bump(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._bump('pools_cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._bump('created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._bump('closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._bump('checkout_failures')
+
+    def connection_checked_out(self, event):
+        self._bump('checked_out')
+
+    def connection_checked_in(self, event):
+        self._bump('checked_in')
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'open': self.created - self.closed,
+                'in_use': self.checked_out - self.checked_in,
+                'created': self.created,
+                'closed': self.closed,
+                'checkouts': self.checked_out,
+                'checkout_failures': self.checkout_failures,
+                'pools_cleared': self.pools_cleared
+            }
+
+def _connect():
+    config = current_app.config
+    client = MongoClient(
+        config["MONGODB_URI"],
+        maxPoolSize=config.get('MONGODB_MAX_POOL_SIZE', 20),
+        minPoolSize=config.get('MONGODB_MIN_POOL_SIZE', 0),
+        maxIdleTimeMS=config.get('MONGODB_MAX_IDLE_TIME_MS', 60000),
+        connectTimeoutMS=config.get('MONGODB_CONNECT_TIMEOUT_MS', 10000),
+        serverSelectionTimeoutMS=config.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 10000),
+        socketTimeoutMS=config.get('MONGODB_SOCKET_TIMEOUT_MS', 60000),
+        waitQueueTimeoutMS=config.get('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 10000),
+        event_listeners=[PoolStats()]
+    )
+    current_app.logger.info(f"Created MongoDB client for process {os.getpid()}")
+    return client
+
+# A MongoClient must not be used across fork, so one created in the gunicorn
+# master (or before a preload fork) is never handed to a worker
+_client = ProcessLocal(_connect)
+
+def get_client():
+    """Return the MongoClient shared by every blueprint of this process."""
+    return _client.get()
+
+def get_database():
+    """Return the application database on the shared client."""
+    return get_client()[current_app.config.get('MONGODB_DB_NAME', 'sushanto')]
+
+def pool_stats():
+    """
+    Return connection pool statistics of this process's client.
+
+    Returns:
+        dict: Pool settings and counters, or only the pid if no client exists yet
+    """
+    client = _client.peek()
+    if client is None:
+        return {'pid': os.getpid(), 'client': False}
+    options = client.options.pool_options
+    stats = next(listener for listener in client.options.event_listeners if isinstance(listener, PoolStats))
+    return {
+        'pid': os.getpid(),
+        'client': True,
+        'max_pool_size': options.max_pool_size,
+        'min_pool_size': options.min_pool_size,
+        **stats.snapshot()
+    }
@@ -0,0 +1,109 @@
+from lxml import etree
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+
+# Namespaces and tag names used by the raw-XML document passes
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+A_NS = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+V_NS = 'urn:schemas-microsoft-com:vml'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+W_BODY = f'{{{W_NS}}}body'
+W_P = f'{{{W_NS}}}p'
+W_T = f'{{{W_NS}}}t'
+W_TR = f'{{{W_NS}}}tr'
+W_TXBX_CONTENT = f'{{{W_NS}}}txbxContent'
+W_PPR = f'{{{W_NS}}}pPr'
+W_PSTYLE = f'{{{W_NS}}}pStyle'
+W_OUTLINE_LVL = f'{{{W_NS}}}outlineLvl'
+W_FLD_CHAR = f'{{{W_NS}}}fldChar'
+W_INSTR_TEXT = f'{{{W_NS}}}instrText'
+W_FLD_SIMPLE = f'{{{W_NS}}}fldSimple'
+W_VAL = f'{{{W_NS}}}val'
+W_INSTR = f'{{{W_NS}}}instr'
+W_FLD_CHAR_TYPE = f'{{{W_NS}}}fldCharType'
+W_DIRTY = f'{{{W_NS}}}dirty'
+A_P = f'{{{A_NS}}}p'
+A_T = f'{{{A_NS}}}t'
+
+# Text nodes owned directly by a paragraph (not by a textbox nested inside it)
+PARAGRAPH_TEXT_XPATH = etree.XPath(
+    './w:r/w:t | ./w:hyperlink/w:r/w:t | ./w:ins/w:r/w:t | ./w:smartTag/w:r/w:t'
+    ' | ./w:fldSimple/w:r/w:t | ./w:sdt/w:sdtContent/w:r/w:t',
+    namespaces={'w': W_NS}
+)
+DRAWING_TEXT_XPATH = etree.XPath('./a:r/a:t | ./a:fld/a:t', namespaces={'a': A_NS})
+
+STORY_RELATIONSHIPS = (RT.HEADER, RT.FOOTER, RT.FOOTNOTES, RT.ENDNOTES)
+
+def iter_related_parts(doc, reltypes):
+    """Yield each XML part the main document relates to with one of reltypes, once each."""
+    seen = set()
+    for rel in doc.part.rels.values():
+        if rel.is_external or rel.reltype not in reltypes:
+            continue
+        part = rel.target_part
+        if id(part) in seen or not hasattr(part, 'element'):
+            continue
+        seen.add(id(part))
+        yield part
+
+def iter_story_parts(doc):
+    """Yield the main document part and every header/footer part it references, once each."""
+    yield doc.part
+    yield from iter_related_parts(doc, STORY_RELATIONSHIPS)
+
+def iter_header_parts(doc):
+    """Yield every header part of the document, once each."""
+    return iter_related_parts(doc, (RT.HEADER,))
+
+def iter_fields(root):
+    """
+    Yield (element, field type) for every field below root, in document order
+    of completion.
+
+    Complex fields span several runs (and often paragraphs): a begin fldChar,
+    instrText runs, a separate fldChar, the result and an end fldChar; they may
+    nest. The begin fldChar is yielded for those. Simple fields are yielded as
+    their w:fldSimple element. The field type is the first word of the
+    instruction, upper-cased (e.g. 'TOC', 'PAGEREF', 'SEQ').
+    """
+    open_fields = []
+    for element in root.iter(W_FLD_CHAR, W_INSTR_TEXT, W_FLD_SIMPLE):
+        if element.tag == W_INSTR_TEXT:
+            if open_fields:
+                open_fields[-1][1].append(element.text or '')
+        elif element.tag == W_FLD_SIMPLE:
+            yield element, _field_type(element.get(W_INSTR, ''))
+        else:
+            char_type = element.get(W_FLD_CHAR_TYPE)
+            if char_type == 'begin':
+                open_fields.append((element, []))
+            elif char_type == 'end' and open_fields:
+                begin, instruction = open_fields.pop()
+                yield begin, _field_type(''.join(instruction))
+
+def _field_type(instruction):
+    words = instruction.split()
+    return words[0].upper() if words else ''
+
+def is_heading_paragraph(paragraph):
+    """True for headings, titles and captions - paragraphs whose text feeds TOC/REF fields."""
+    properties = paragraph.find(W_PPR)
+    if properties is None:
+        return False
+    if properties.find(W_OUTLINE_LVL) is not None:
+        return True
+    style = properties.find(W_PSTYLE)
+    if style is None:
+        return False
+    return style.get(W_VAL, '').startswith(('Heading', 'Title', 'Caption'))
+
+def paragraph_text_nodes(paragraph):
+    """Return the text nodes of a w:p or a:p element, in document order."""
+    if paragraph.tag == W_P:
+        return PARAGRAPH_TEXT_XPATH(paragraph)
+    return DRAWING_TEXT_XPATH(paragraph)
+
+def paragraph_text(paragraph):
+    """Return the visible text of a w:p or a:p element."""
+    return ''.join(node.text or '' for node in paragraph_text_nodes(paragraph))
@@ -0,0 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor
+from utils.process_local import ProcessLocal
+
+_executor = ProcessLocal(
+    lambda max_workers: ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='word-jobs')
+)
+
+def get_executor(max_workers):
+    """Return this process's background executor, creating it on first use."""
+    return _executor.get(max_workers)
+
+def submit(app, fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) on the background executor inside an application
+    context of app, so it can use current_app like a request handler.
+
+    Returns:
+        Future: The future of the call
+    """
+    def run():
+        with app.app_context():
+            return fn(*args, **kwargs)
+    return get_executor(app.config.get('GENERATION_WORKERS', 2)).submit(run)
@@ -0,0 +1,124 @@
+"""
+Versioned, idempotent MongoDB schema migrations.
+
+Run them once per deploy, not in the workers:
+
+    flask --app app migrate
+
+The applied version is recorded in the meta collection; workers only read it
+(see check_schema_version). Where each deploy target runs them:
+
+    Elastic Beanstalk   .ebextensions/06_migrate.config, on the leader instance
+    Render              start.sh runs them before starting gunicorn
+    zappa (Lambda)      after each `zappa deploy` or `zappa update`:
+                            zappa invoke <stage> 'app.run_migrations'
+    Vercel              no deploy hook: run the command above with the
+                        production MONGODB_URI (from CI or a workstation)
+                        before each deploy
+
+A fresh database that was never migrated has no unique username index and
+no bulk_files index.
+"""
+from datetime import datetime, timezone
+
+META_COLLECTION = 'meta'
+SCHEMA_DOCUMENT_ID = 'schema'
+
+def _initial_schema(db):
+    """Collections, indexes, user backfills and validation from the original setup_mongodb."""
+    existing = set(db.list_collection_names())
+    for name in ('users', 'documents'):
+        if name not in existing:
+            db.create_collection(name)
+
+    db.users.create_index('username', unique=True)
+    db.users.create_index([('role', 1), ('status', 1)])
+    db.documents.create_index([('user_id', 1)])
+    db.documents.create_index([('bulk_id', 1)])
+    db.documents.create_index([('created_at', -1)])
+
+    # Update existing users with new fields
+    db.users.update_many(
+        {'status': {'$exists': False}},
+        {'$set': {'status': 'active'}}
+    )
+    db.users.update_many(
+        {'created_at': {'$exists': False}},
+        {'$set': {'created_at': datetime.now(timezone.utc).isoformat()}}
+    )
+
+    # Add validation rules
+    db.command({
+        'collMod': 'users',
+        'validator': {
+            '$jsonSchema': {
+                'bsonType': 'object',
+                'required': ['username', 'password', 'role', 'status'],
+                'properties': {
+                    'username': {'bsonType': 'string'},
+                    'password': {'bsonType': 'string'},
+                    'role': {'enum': ['user', 'admin']},
+                    'status': {'enum': ['active', 'restricted']},
+                    'created_at': {'bsonType': 'string'}
+                }
+            }
+        }
+    })
+
+def _bulk_files(db):
+    """Child records of bulk jobs, listed per job in row order."""
+    db.bulk_files.create_index([('bulk_id', 1), ('row', 1)])
+
+# (version, description, migration); append only, never renumber
+MIGRATIONS = [
+    (1, 'initial schema', _initial_schema),
+    (2, 'bulk_files index', _bulk_files),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(db):
+    """Return the schema version recorded in the database, 0 if none."""
+    meta = db[META_COLLECTION].find_one({'_id': SCHEMA_DOCUMENT_ID}, {'version': 1})
+    return meta['version'] if meta else 0
+
+def migrate(db, logger):
+    """
+    Apply every migration newer than the recorded schema version, in order.
+
+    Each migration is idempotent and the version is recorded after each one,
+    so an interrupted run can simply be repeated.
+
+    Returns:
+        list: Versions applied by this run
+    """
+    current = get_schema_version(db)
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"Applying schema migration {version}: {description}")
+        migration(db)
+        db[META_COLLECTION].update_one(
+            {'_id': SCHEMA_DOCUMENT_ID},
+            {'$set': {'version': version, 'updated_at': datetime.now(timezone.utc).isoformat()}},
+            upsert=True
+        )
+        applied.append(version)
+    return applied
+
+def check_schema_version(db, logger):
+    """
+    Cheap boot-time check: a single read of the recorded schema version.
+
+    Returns:
+        bool: True if the database is at the version this code expects
+    """
+    version = get_schema_version(db)
+    if version < SCHEMA_VERSION:
+        logger.warning(
+            f"MongoDB schema is at version {version}, this code expects {SCHEMA_VERSION}; "
+            f"run 'flask --app app migrate'"
+        )
+        return False
+    return True
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+# Bump whenever a code change alters the documents generated from the same
+# template and payload: the disk tier outlives redeploys, and entries keyed
+# under an older version are then never served again
+OUTPUT_FORMAT_VERSION = 1
+
+def output_key(content_hash, payload):
+    """
+    Content address of a generated document: OUTPUT_FORMAT_VERSION, the
+    template's content hash and the normalized, JSON-serializable input payload.
+    """
+    digest = hashlib.sha256(f'{OUTPUT_FORMAT_VERSION}:{content_hash}'.encode('ascii'))
+    digest.update(json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+    return digest.hexdigest()
+
+class OutputCache:
+    """
+    Two-tier cache of generated .docx files, keyed by output_key.
+
+    The memory tier is a per-process LRU bounded by total bytes. The disk tier
+    is a directory shared by every worker on the host, capped in total size
+    and evicted oldest-used first; files are written to a temporary name and
+    renamed into place, so concurrent workers never read a partial file.
+
+    A purge generation number kept in the directory is bumped by purge();
+    every worker compares it with the one it last saw before using its
+    memory tier, so a purge handled by one worker empties all of them.
+    """
+
+    GENERATION_FILE = 'purge-generation'
+
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> bytes
+        self._memory_bytes = 0
+        self._generation = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def _config(self):
+        config = current_app.config
+        return (
+            config.get('OUTPUT_CACHE_MEMORY_BYTES', 64 * 1024 * 1024),
+            config.get('OUTPUT_CACHE_DISK_BYTES', 1024 * 1024 * 1024),
+            config.get('OUTPUT_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'word-output-cache')
+        )
+
+    def _path(self, directory, key):
+        return os.path.join(directory, f'{key}.docx')
+
+    def _read_generation(self, directory):
+        try:
+            with open(os.path.join(directory, self.GENERATION_FILE)) as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _sync_generation(self, directory):
+        """Drop this worker's memory tier if another worker purged since we last looked."""
+        generation = self._read_generation(directory)
+        with self._lock:
+            if self._generation is not None and generation != self._generation:
+                self._memory.clear()
+                self._memory_bytes = 0
+            self._generation = generation
+
+    def get(self, key):
+        """
+        Look up a generated document.
+
+        Returns:
+            bytes: The cached .docx, or None on a miss
+        """
+        memory_limit, disk_limit, directory = self._config()
+        self._sync_generation(directory)
+        with self._lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return blob
+
+        if disk_limit > 0:
+            path = self._path(directory, key)
+            try:
+                with open(path, 'rb') as f:
+                    blob = f.read()
+                os.utime(path)  # mark as recently used for eviction
+            except FileNotFoundError:
+                blob = None
+            if blob is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, blob, memory_limit)
+                return blob
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, blob):
+        """Store a generated document in both tiers."""
+        memory_limit, disk_limit, directory = self._config()
+        self._sync_generation(directory)
+        self._remember(key, blob, memory_limit)
+        with self._lock:
+            self.stores += 1
+
+        if disk_limit <= 0 or len(blob) > disk_limit:
+            return
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            os.replace(temp_path, self._path(directory, key))
+            self._evict_disk(directory, disk_limit)
+        except OSError as e:
+            current_app.logger.warning(f"Could not write output cache entry {key[:12]}: {str(e)}")
+
+    def _remember(self, key, blob, memory_limit):
+        if len(blob) > memory_limit:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            self._memory[key] = blob
+            self._memory_bytes += len(blob)
+            while self._memory_bytes > memory_limit:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _disk_entries(self, directory):
+        entries = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.name.endswith('.docx'):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _evict_disk(self, directory, disk_limit):
+        entries = self._disk_entries(directory)
+        total = sum(size for _, size, _ in entries)
+        if total <= disk_limit:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= disk_limit:
+                break
+
+    def purge(self):
+        """
+        Drop every entry from the shared disk tier and from the memory tier of
+        this process; other workers drop theirs on their next lookup.
+
+        Returns:
+            dict: Number of memory and disk entries removed, and the new purge generation
+        """
+        _, _, directory = self._config()
+        os.makedirs(directory, exist_ok=True)
+        generation = self._read_generation(directory) + 1
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(generation))
+        os.replace(temp_path, os.path.join(directory, self.GENERATION_FILE))
+
+        with self._lock:
+            memory_entries = len(self._memory)
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._generation = generation
+
+        disk_entries = 0
+        for _, _, path in self._disk_entries(directory):
+            try:
+                os.remove(path)
+                disk_entries += 1
+            except FileNotFoundError:
+                pass
+        return {'memory_entries': memory_entries, 'disk_entries': disk_entries, 'generation': generation}
+
+    def stats(self):
+        memory_limit, disk_limit, directory = self._config()
+        self._sync_generation(directory)
+        entries = self._disk_entries(directory)
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'memory_limit': memory_limit,
+                'disk_entries': len(entries),
+                'disk_bytes': sum(size for _, size, _ in entries),
+                'disk_limit': disk_limit,
+                'generation': self._generation,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'stores': self.stores
+            }
+
+output_cache = OutputCache()
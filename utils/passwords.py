@@ -0,0 +1,153 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from bcrypt import checkpw, gensalt, hashpw
+from flask import current_app
+from utils.process_local import ProcessLocal
+
+class PasswordQueueFull(Exception):
+    """Raised when too many password hashes are already waiting for the executor."""
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a small executor per worker process instead of inline.
+
+    bcrypt releases the GIL, so hashing on these threads leaves the rest of
+    the process free to serve requests; at most PASSWORD_HASH_WORKERS hashes
+    run at once, and once PASSWORD_HASH_QUEUE_SIZE calls are pending further
+    ones are refused with PasswordQueueFull rather than queued without bound.
+
+    Callers wait on the result, so this only helps with threaded workers
+    (gunicorn --worker-class gthread); a sync worker blocks either way.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = ProcessLocal(self._create_executor)
+        self.pending = 0
+        self.running = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _create_executor(self):
+        # Calls pending in a parent process never finish in this one
+        self.pending = self.running = 0
+        return ThreadPoolExecutor(
+            max_workers=current_app.config.get('PASSWORD_HASH_WORKERS', 2),
+            thread_name_prefix='bcrypt'
+        )
+
+    def submit(self, fn, *args):
+        """
+        Queue fn(*args) on the executor.
+
+        Returns:
+            Future: The future of the call
+
+        Raises:
+            PasswordQueueFull: If the queue is at PASSWORD_HASH_QUEUE_SIZE
+        """
+        limit = current_app.config.get('PASSWORD_HASH_QUEUE_SIZE', 32)
+        with self._lock:
+            executor = self._executor.get()
+            if self.pending >= limit:
+                self.rejected += 1
+                raise PasswordQueueFull(f"{self.pending} password operations already pending")
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+
+        def run():
+            with self._lock:
+                self.running += 1
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.pending -= 1
+                    self.completed += 1
+
+        try:
+            return executor.submit(run)
+        except BaseException:
+            with self._lock:
+                self.pending -= 1
+            raise
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'workers': current_app.config.get('PASSWORD_HASH_WORKERS', 2),
+                'queue_limit': current_app.config.get('PASSWORD_HASH_QUEUE_SIZE', 32),
+                'pending': self.pending,
+                'running': self.running,
+                'queued': self.pending - self.running,
+                'peak_pending': self.peak_pending,
+                'completed': self.completed,
+                'rejected': self.rejected
+            }
+
+password_hasher = PasswordHasher()
+
+def bcrypt_rounds():
+    """Work factor of new password hashes (BCRYPT_ROUNDS)."""
+    return current_app.config.get('BCRYPT_ROUNDS', 12)
+
+def hash_password(password):
+    """
+    Hash a password with the configured work factor on the password executor.
+
+    Returns:
+        str: The bcrypt hash
+
+    Raises:
+        PasswordQueueFull: If the executor is saturated
+    """
+    salt = gensalt(rounds=bcrypt_rounds())
+    hashed = password_hasher.submit(hashpw, password.encode('utf-8'), salt).result()
+    return hashed.decode('utf-8')
+
+def verify_password(password, hashed_password):
+    """
+    Check a password against a stored bcrypt hash on the password executor.
+
+    Raises:
+        PasswordQueueFull: If the executor is saturated
+    """
+    return password_hasher.submit(
+        checkpw, password.encode('utf-8'), hashed_password.encode('utf-8')
+    ).result()
+
+def needs_rehash(hashed_password):
+    """True if a stored hash was made with a work factor other than BCRYPT_ROUNDS."""
+    try:
+        return int(hashed_password.split('$')[2]) != bcrypt_rounds()
+    except (IndexError, ValueError):
+        return False
+
+def rehash_in_background(app, users_collection, user_id, password, old_hash):
+    """
+    Replace a user's password hash with one at the current work factor,
+    without making the caller wait. Skipped if the executor is saturated;
+    the next login tries again.
+    """
+    rounds = bcrypt_rounds()
+
+    def rehash():
+        try:
+            hashed = hashpw(password.encode('utf-8'), gensalt(rounds=rounds)).decode('utf-8')
+            # Only if the password was not changed meanwhile
+            users_collection.update_one(
+                {'_id': user_id, 'password': old_hash},
+                {'$set': {'password': hashed}}
+            )
+            app.logger.info(f"Rehashed password of user {user_id} at cost {rounds}")
+        except Exception as e:
+            app.logger.error(f"Password rehash of user {user_id} failed: {str(e)}")
+
+    try:
+        password_hasher.submit(rehash)
+    except PasswordQueueFull:
+        app.logger.info(f"Password rehash of user {user_id} deferred, executor is busy")
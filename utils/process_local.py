@@ -0,0 +1,48 @@
+import os
+import threading
+
+class ProcessLocal:
+    """
+    A value created lazily, once per process.
+
+    gunicorn forks its workers from the master, and executor threads, client
+    sockets and pool processes do not survive a fork; a value inherited from
+    the parent is therefore never returned in a child, which creates its own
+    on first use instead.
+    """
+
+    def __init__(self, factory):
+        """
+        Args:
+            factory: Called with the arguments of the first get() in each
+                process; a None result is not kept, so the next get() retries
+        """
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self._pid = None
+
+    def get(self, *args, **kwargs):
+        """Return this process's value, creating it with factory(*args, **kwargs) if needed."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._value
+        with self._lock:
+            if self._pid != pid:
+                value = self._factory(*args, **kwargs)
+                if value is None:
+                    return None
+                self._value = value
+                self._pid = pid
+            return self._value
+
+    def peek(self):
+        """Return this process's value without creating it, None if there is none yet."""
+        return self._value if self._pid == os.getpid() else None
+
+    def discard(self, value):
+        """Forget value if it is still this process's, so the next get() creates a new one."""
+        with self._lock:
+            if self._pid == os.getpid() and self._value is value:
+                self._value = None
+                self._pid = None
@@ -0,0 +1,482 @@
+import copy
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from docx import Document
+from docx.opc.constants import CONTENT_TYPE as CT
+from flask import current_app
+from utils.docx_xml import (
+    A_P, A_T, W_BODY, W_P, W_TR, W_TXBX_CONTENT, V_NS,
+    is_heading_paragraph, iter_fields, iter_story_parts, paragraph_text
+)
+
+PLACEHOLDER_TOKEN_PATTERN = re.compile(r'\{\{[^{}]+\}\}')
+
+V_TEXTBOX = f'{{{V_NS}}}textbox'
+
+def _element_path(root, element):
+    """Child indices leading from root down to element."""
+    path = []
+    while element is not root:
+        parent = element.getparent()
+        path.append(parent.index(element))
+        element = parent
+    path.reverse()
+    return tuple(path)
+
+def _resolve_path(root, path):
+    for child_index in path:
+        root = root[child_index]
+    return root
+
+def _story_roots(doc):
+    return {str(part.partname): part.element for part in iter_story_parts(doc)}
+
+class IndexedParagraph:
+    """Compile-time location of one paragraph that contains placeholder tokens."""
+
+    __slots__ = ('part_name', 'path', 'tokens', 'row_depth', 'body_level', 'in_textbox', 'heading')
+
+    def __init__(self, part_name, path, tokens, row_depth, body_level, in_textbox, heading):
+        self.part_name = part_name
+        self.path = path  # child indices from the part root down to the paragraph
+        self.tokens = tokens
+        self.row_depth = row_depth  # depth below the part root of the enclosing w:tr, if any
+        self.body_level = body_level
+        self.in_textbox = in_textbox
+        self.heading = heading
+
+class BoundParagraph:
+    """An indexed paragraph resolved against one request's copy of the template."""
+
+    __slots__ = ('element', 'row', 'tokens', 'body_level', 'in_textbox', 'heading', 'part_name')
+
+    def __init__(self, element, row, entry):
+        self.element = element
+        self.row = row
+        self.tokens = entry.tokens
+        self.body_level = entry.body_level
+        self.in_textbox = entry.in_textbox
+        self.heading = entry.heading
+        self.part_name = entry.part_name
+
+class PlaceholderIndex:
+    """
+    Map of every {{...}} token in a template to the paragraphs, table rows and
+    parts that contain it.
+
+    Locations are stored as child-index paths rather than element references so
+    that the index, built once on the pristine template, can be resolved against
+    any deep copy of it.
+    """
+
+    def __init__(self, paragraphs):
+        self.paragraphs = paragraphs
+        self._manifest = None
+        self.tokens = {}
+        for entry in paragraphs:
+            for token in entry.tokens:
+                self.tokens.setdefault(token, []).append(entry)
+
+    @classmethod
+    def build(cls, doc):
+        paragraphs = []
+        for part in iter_story_parts(doc):
+            root = part.element
+            for element in root.iter(W_P, A_P):
+                tokens = PLACEHOLDER_TOKEN_PATTERN.findall(paragraph_text(element))
+                if not tokens:
+                    continue
+
+                path = _element_path(root, element)
+                row_depth = None
+                in_textbox = False
+                for depth, ancestor in enumerate(element.iterancestors(), 1):
+                    if ancestor is root:
+                        break
+                    if ancestor.tag == W_TR and row_depth is None:
+                        # Counted from the paragraph upwards; stored as a depth from the root
+                        row_depth = len(path) - depth
+                    elif ancestor.tag in (W_TXBX_CONTENT, V_TEXTBOX):
+                        in_textbox = True
+
+                paragraphs.append(IndexedParagraph(
+                    part_name=str(part.partname),
+                    path=path,
+                    tokens=frozenset(tokens),
+                    row_depth=row_depth,
+                    body_level=element.getparent().tag == W_BODY,
+                    in_textbox=in_textbox,
+                    heading=element.tag == W_P and is_heading_paragraph(element)
+                ))
+        return cls(paragraphs)
+
+    def bind(self, doc):
+        """
+        Resolve every indexed location against a copy of the template.
+
+        Must be called before the copy is modified, since removing elements
+        shifts the child indices the paths are made of.
+
+        Returns:
+            list: BoundParagraph objects, in document order per part
+        """
+        roots = _story_roots(doc)
+        bound = []
+        for entry in self.paragraphs:
+            node = roots[entry.part_name]
+            row = None
+            for depth, child_index in enumerate(entry.path, 1):
+                node = node[child_index]
+                if depth == entry.row_depth:
+                    row = node
+            bound.append(BoundParagraph(node, row, entry))
+        return bound
+
+    def manifest(self):
+        """Summarise where each placeholder occurs in the template."""
+        if self._manifest is not None:
+            return self._manifest
+        manifest = {}
+        for token in sorted(self.tokens):
+            entries = self.tokens[token]
+            manifest[token] = {
+                'occurrences': len(entries),
+                'parts': sorted({entry.part_name for entry in entries}),
+                'table_rows': sum(1 for entry in entries if entry.row_depth is not None),
+                'textboxes': sum(1 for entry in entries if entry.in_textbox)
+            }
+        self._manifest = manifest
+        return manifest
+
+class FieldIndex:
+    """
+    Every complex and simple field of a template's story parts, recorded once
+    with its type, its begin fldChar (or fldSimple) location and its part.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields  # (part name, path, field type)
+
+    @classmethod
+    def build(cls, doc):
+        fields = []
+        for part in iter_story_parts(doc):
+            root = part.element
+            for element, field_type in iter_fields(root):
+                fields.append((str(part.partname), _element_path(root, element), field_type))
+        return cls(fields)
+
+    def bind(self, doc, field_types=None):
+        """
+        Resolve the fields, optionally only those of some types, against a copy
+        of the template. Like PlaceholderIndex.bind, call before modifying it.
+
+        Returns:
+            list: (element, field type) pairs
+        """
+        roots = _story_roots(doc)
+        return [
+            (_resolve_path(roots[part_name], path), field_type)
+            for part_name, path, field_type in self.fields
+            if field_types is None or field_type in field_types
+        ]
+
+    def counts(self):
+        counts = {}
+        for _, _, field_type in self.fields:
+            counts[field_type] = counts.get(field_type, 0) + 1
+        return counts
+
+PART_KINDS = {
+    CT.WML_DOCUMENT_MAIN: 'document',
+    CT.WML_HEADER: 'header',
+    CT.WML_FOOTER: 'footer',
+    CT.WML_FOOTNOTES: 'footnotes',
+    CT.WML_ENDNOTES: 'endnotes',
+    CT.WML_COMMENTS: 'comments',
+    CT.DML_CHART: 'chart'
+}
+
+class IndexedPart:
+    """Compile-time classification of one package part."""
+
+    __slots__ = ('partname', 'kind', 'editable', 'textboxes', 'drawing_text')
+
+    def __init__(self, partname, kind, editable, textboxes, drawing_text):
+        self.partname = partname
+        self.kind = kind
+        self.editable = editable  # loaded by python-docx as an XML tree
+        self.textboxes = textboxes
+        self.drawing_text = drawing_text
+
+class PartIndex:
+    """
+    Classification of a template's story parts (document, headers, footers,
+    notes, comments, charts), recording which ones hold textboxes or
+    DrawingML text, so textbox passes can skip every other part.
+    """
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    @classmethod
+    def build(cls, doc):
+        parts = []
+        for part in doc.part.package.iter_parts():
+            kind = PART_KINDS.get(part.content_type)
+            if kind is None:
+                continue
+            element = getattr(part, 'element', None)
+            if element is not None:
+                textboxes = next(element.iter(W_TXBX_CONTENT, V_TEXTBOX), None) is not None
+                drawing_text = next(element.iter(A_T), None) is not None
+            else:
+                blob = part.blob
+                textboxes = b'txbxContent' in blob or b'textbox' in blob
+                drawing_text = b'<a:t>' in blob or b'<a:t ' in blob
+            parts.append(IndexedPart(str(part.partname), kind, element is not None, textboxes, drawing_text))
+        return cls(parts)
+
+    def textbox_parts(self, doc, kinds=None):
+        """
+        Resolve the editable parts that contain textboxes or DrawingML text
+        against a copy of the template, optionally restricted to some kinds.
+
+        Returns:
+            list: python-docx parts of doc, each at most once
+        """
+        wanted = {
+            entry.partname for entry in self.parts
+            if entry.editable and (entry.textboxes or entry.drawing_text)
+            and (kinds is None or entry.kind in kinds)
+        }
+        if not wanted:
+            return []
+        return [part for part in doc.part.package.iter_parts() if str(part.partname) in wanted]
+
+    def summary(self):
+        return [
+            {
+                'part': entry.partname,
+                'kind': entry.kind,
+                'textboxes': entry.textboxes,
+                'drawing_text': entry.drawing_text
+            }
+            for entry in self.parts
+        ]
+
+class CompiledTemplate:
+    """A parsed, pristine template package that hands out per-request copies."""
+
+    def __init__(self, path, content_hash, document):
+        self.path = path
+        self.content_hash = content_hash
+        self._document = document
+        self.parts = PartIndex.build(document)
+        self.placeholders = PlaceholderIndex.build(document)
+        self.fields = FieldIndex.build(document)
+
+    def clone(self):
+        """
+        Return an independent Document for one request.
+
+        Deep-copying the already parsed part trees takes roughly half to
+        two thirds of the time of unzipping and parsing the .docx again, and
+        the gap grows with table-heavy templates (see
+        benchmarks/document_passes.py). The file is not re-read either, and
+        the compiled indexes are rebound rather than rebuilt. Binary parts
+        such as images are immutable bytes and are shared rather than copied.
+        """
+        return copy.deepcopy(self._document)
+
+class TemplateCache:
+    """
+    Per-process cache of compiled templates.
+
+    Files are tracked by path with their mtime and size; a change in either
+    triggers a re-hash, and only a change of content hash triggers a re-parse.
+    Compiled templates are keyed by content hash, so identical template files
+    share one parsed package.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}  # path -> (mtime_ns, size, content_hash)
+        self._compiled = {}  # content_hash -> CompiledTemplate
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        """
+        Get the compiled template for a template file, compiling it if needed.
+
+        Args:
+            path (str): Path to the .docx template
+
+        Returns:
+            CompiledTemplate: The compiled template for the file's current content
+        """
+        stat = os.stat(path)
+        with self._lock:
+            tracked = self._files.get(path)
+            if tracked and tracked[:2] == (stat.st_mtime_ns, stat.st_size):
+                compiled = self._compiled.get(tracked[2])
+                if compiled is not None:
+                    self.hits += 1
+                    return compiled
+
+        with open(path, 'rb') as f:
+            blob = f.read()
+        content_hash = hashlib.sha256(blob).hexdigest()
+
+        with self._lock:
+            compiled = self._compiled.get(content_hash)
+            if compiled is None:
+                self.misses += 1
+                compiled = CompiledTemplate(path, content_hash, Document(BytesIO(blob)))
+                self._compiled[content_hash] = compiled
+                current_app.logger.info(f"Compiled template {os.path.basename(path)} ({content_hash[:12]})")
+            else:
+                self.hits += 1
+
+            previous = self._files.get(path)
+            self._files[path] = (stat.st_mtime_ns, stat.st_size, content_hash)
+            if previous and previous[2] != content_hash:
+                self._discard(previous[2])
+            return compiled
+
+    def _discard(self, content_hash):
+        # Drop a superseded compiled template unless another path still uses it
+        if all(entry[2] != content_hash for entry in self._files.values()):
+            self._compiled.pop(content_hash, None)
+
+    def clear(self):
+        with self._lock:
+            self._files.clear()
+            self._compiled.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'templates': len(self._compiled),
+                'files': len(self._files),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+# Shared by every request handled in this worker process
+template_cache = TemplateCache()
+
+class TemplateSkeleton(CompiledTemplate):
+    """
+    A compiled template already pruned for one segment/sub-segment presence
+    bitmap, with its indexes rebuilt on the pruned tree.
+    """
+
+    def __init__(self, template, presence, document, pruned):
+        self.base = template
+        self.presence = presence
+        self.pruned = pruned  # anything removed, i.e. reference fields need updating
+        super().__init__(template.path, template.content_hash, document)
+
+class SkeletonCache:
+    """
+    Per-process LRU cache of pruned template skeletons.
+
+    Section pruning and removal of unfilled segment rows depend only on which
+    slots a request fills, not on the values, so the pruned tree is built once
+    per (template content hash, presence bitmap) and every request with the
+    same shape just clones it.
+    """
+
+    def __init__(self, maxsize=None):
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._skeletons = OrderedDict()  # (content_hash, presence) -> TemplateSkeleton
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, template, presence, prune):
+        """
+        Get the skeleton of a template for a presence bitmap, building it if needed.
+
+        Args:
+            template (CompiledTemplate): The unpruned template
+            presence (int): Bitmap of the filled segment/sub-segment slots
+            prune (callable): Prunes a TemplateInstance in place for this presence;
+                returns True if anything was removed
+
+        Returns:
+            TemplateSkeleton: The pruned template
+        """
+        key = (template.content_hash, presence)
+        with self._lock:
+            skeleton = self._skeletons.get(key)
+            if skeleton is not None:
+                self._skeletons.move_to_end(key)
+                self.hits += 1
+                return skeleton
+
+        # Built outside the lock; a concurrent build of the same key is harmless
+        instance = TemplateInstance(template, template.clone())
+        pruned = prune(instance)
+        skeleton = TemplateSkeleton(template, presence, instance.doc, pruned)
+
+        with self._lock:
+            self.misses += 1
+            self._skeletons[key] = skeleton
+            self._skeletons.move_to_end(key)
+            while len(self._skeletons) > self.maxsize():
+                self._skeletons.popitem(last=False)
+        current_app.logger.info(
+            f"Built skeleton of {os.path.basename(template.path)} for presence {presence:#x} "
+            f"({self.hits} hits, {self.misses} misses)"
+        )
+        return skeleton
+
+    def maxsize(self):
+        if self._maxsize is not None:
+            return self._maxsize
+        return current_app.config.get('SKELETON_CACHE_SIZE', 64)
+
+    def clear(self):
+        with self._lock:
+            self._skeletons.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'skeletons': len(self._skeletons),
+                'maxsize': self.maxsize(),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+skeleton_cache = SkeletonCache()
+
+class TemplateInstance:
+    """A request-owned copy of a compiled template with its indexes bound to it."""
+
+    __slots__ = ('template', 'doc', 'placeholders', 'fields')
+
+    def __init__(self, template, doc):
+        self.template = template
+        self.doc = doc
+        self.placeholders = template.placeholders.bind(doc)
+        self.fields = template.fields.bind(doc)
+
+def load_template(path, presence=None, prune=None):
+    """
+    Return a fresh, request-owned TemplateInstance of the template at path.
+
+    With a presence bitmap and a prune callable, the copy is taken from the
+    matching cached skeleton, so it is already pruned for that shape.
+    """
+    template = template_cache.get(path)
+    if prune is not None:
+        template = skeleton_cache.get(template, presence, prune)
+    return TemplateInstance(template, template.clone())